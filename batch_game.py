@@ -0,0 +1,246 @@
+import numpy
+
+import tables
+
+
+class BatchGame(object):
+    """Many games of 2048 played together, one move for every game at a time.
+
+    The boards are held in an array of 64 bit integers laid out as in bitboard.BitboardGame, with each tile stored as
+    a 4 bit exponent and each row of the grid as a 16 bit word. Moves and tile spawns are carried out for all of the
+    games at once through the row lookup tables.
+    """
+
+    def __init__(self, n, seed=None, seeds=None):
+        """Creates the games and sets up the boards.
+
+        @param n: the number of games to play
+        @param seed: seed for the random number generator used to spawn tiles
+        @param seeds: a seed for each game, giving each its own stream of random numbers for spawning tiles instead.
+        Games given the same seed spawn the same tiles for the same moves.
+        """
+        self.n = n
+        self.grid_size = 4
+        self.rng = numpy.random.RandomState(seed)
+        self.streams = None
+        if seeds is not None:
+            if len(seeds) != n:
+                raise ValueError("Expected a seed for each of the %i games" % n)
+            self.streams = [numpy.random.RandomState(s) for s in seeds]
+            # A block of draws from each stream, read from the offset in used, with every block starting used up
+            self.draws = numpy.zeros((n, _stream_block))
+            self.used = numpy.full(n, _stream_block, dtype=numpy.intp)
+        self.boards = numpy.zeros(n, dtype=numpy.uint64)
+        self.scores = numpy.zeros(n, dtype=numpy.int64)
+        self.playing = numpy.ones(n, dtype=bool)
+        self.new_game()
+
+    def new_game(self):
+        """Starts all of the games again."""
+        self.boards[:] = 0
+        self.scores[:] = 0
+        self.playing[:] = True
+        self._spawn_tiles(self.playing)
+        self._spawn_tiles(self.playing)
+
+    def start_from(self, boards, scores):
+        """Starts every game from a position just after a move, spawning a tile in each as the move would.
+
+        @param boards: an array of the board of each game after the move, as 64 bit integers of 4 bit exponents
+        @param scores: an array of the score of each game after the move
+        """
+        self.boards[:] = boards
+        self.scores[:] = scores
+        self.playing[:] = True
+        self._spawn_tiles(self.playing)
+        self.playing[:] = test_available_moves(self.boards)
+
+    def get_scores(self):
+        """:returns the current score of each game"""
+        return self.scores
+
+    def get_playing(self):
+        """:returns a mask of the games that are still playable"""
+        return self.playing
+
+    def get_grids(self):
+        """Returns the tile values of every game, indexed as grids[game, x, y] to match game.Game.grid.
+
+        @return: an array of shape (n, 4, 4) holding 0 for a free space or the value of the tile
+        """
+        exponents = (self.boards[:, None] >> _shifts) & 0xF
+        values = numpy.where(exponents == 0, 0, numpy.left_shift(1, exponents.astype(numpy.int64)))
+        return values.reshape(self.n, 4, 4).transpose(0, 2, 1)
+
+    def make_move(self, directions):
+        """Carries out one move in each game that is still playing.
+
+        Invalid moves leave their game unchanged, as for game.Game.make_move. A tile is spawned in each game where
+        the move was valid, and games with no moves left are marked as finished.
+
+        @param directions: an array holding the index in game.moves of the direction to move each game in
+        @return: the score gained by each game, a mask of the games where the move was valid and a mask of the games
+        that are over
+        """
+        directions = numpy.asarray(directions)
+        deltas = numpy.zeros(self.n, dtype=numpy.int64)
+        valid = numpy.zeros(self.n, dtype=bool)
+
+        for direction in range(4):
+            games = numpy.flatnonzero(self.playing & (directions == direction))
+            if games.size == 0:
+                continue
+            old = self.boards[games]
+            new, score = move(old, direction)
+            valid[games] = new != old
+            deltas[games] = score
+            self.boards[games] = new
+
+        deltas[~valid] = 0
+        self.scores += deltas
+        self._spawn_tiles(valid)
+
+        finished = numpy.flatnonzero(valid)
+        self.playing[finished] = test_available_moves(self.boards[finished])
+        return deltas, valid, ~self.playing
+
+    def test_moves(self):
+        """Returns which moves are legal in each game.
+
+        @return: an array of shape (n, 4) which is True where the move with that index in game.moves is legal
+        """
+        legal = numpy.empty((self.n, 4), dtype=bool)
+        for direction in range(4):
+            legal[:, direction] = move(self.boards, direction)[0] != self.boards
+        legal[~self.playing] = False
+        return legal
+
+    def _spawn_tiles(self, mask):
+        """Randomly spawns a new tile in an available space of each selected game.
+
+        @param mask: a mask of the games to spawn a tile in, each of which must have a free space
+        """
+        games = numpy.flatnonzero(mask)
+        if games.size == 0:
+            return
+        boards = self.boards[games]
+
+        # Pick a random free space in each board, counting along the nibbles
+        empty = ((boards[:, None] >> _shifts) & 0xF) == 0
+        choice = (self._random_sample(games) * empty.sum(axis=1)).astype(numpy.int64)
+        position = (empty.cumsum(axis=1) <= choice[:, None]).sum(axis=1)
+
+        exponents = numpy.where(self._random_sample(games) < 0.1, 2, 1).astype(numpy.uint64)
+        self.boards[games] = boards | (exponents << _shifts[position])
+
+    def _random_sample(self, games):
+        """Returns a random float in [0, 1) for each selected game, from the game's own stream if it has one.
+
+        @param games: an array of the indices of the games
+        """
+        if self.streams is None:
+            return self.rng.random_sample(games.size)
+
+        # Draw the next block of each stream that has used up its last, so every game sees the same sequence whatever
+        # the others do
+        exhausted = games[self.used[games] >= _stream_block]
+        for g in exhausted:
+            self.draws[g] = self.streams[g].random_sample(_stream_block)
+        self.used[exhausted] = 0
+        values = self.draws[games, self.used[games]]
+        self.used[games] += 1
+        return values
+
+
+class SpawnStream(object):
+    """The stream of random numbers BatchGame spawns the tiles of a seeded game from, for a single game.
+
+    It has the random method of a random.Random, so a game.Game given one spawns the same tiles for the same moves as
+    the game with the same seed in a BatchGame, as both draw a number for the space and then one for the value of
+    each new tile.
+    """
+
+    def __init__(self, seed):
+        """Sets up the stream.
+
+        @param seed: the seed of the game
+        """
+        self.stream = numpy.random.RandomState(seed)
+        self.draws = []
+        self.used = 0
+
+    def random(self):
+        """Returns the next random float in [0, 1)."""
+        if self.used >= len(self.draws):
+            # Drawn in blocks as BatchGame does, though the numbers are the same however many are drawn at a time
+            self.draws = self.stream.random_sample(_stream_block).tolist()
+            self.used = 0
+        self.used += 1
+        return self.draws[self.used - 1]
+
+
+def transpose(boards):
+    """Swaps the rows and columns of an array of 64 bit boards.
+
+    @param boards: an array of boards as 64 bit integers of 4 bit exponents
+    @return: the transposed boards
+    """
+    a1 = boards & numpy.uint64(0xF0F00F0FF0F00F0F)
+    a2 = boards & numpy.uint64(0x0000F0F00000F0F0)
+    a3 = boards & numpy.uint64(0x0F0F00000F0F0000)
+    a = a1 | (a2 << numpy.uint64(12)) | (a3 >> numpy.uint64(12))
+    b1 = a & numpy.uint64(0xFF00FF0000FF00FF)
+    b2 = a & numpy.uint64(0x00FF00FF00000000)
+    b3 = a & numpy.uint64(0x00000000FF00FF00)
+    return b1 | (b2 >> numpy.uint64(24)) | (b3 << numpy.uint64(24))
+
+
+def move(boards, direction):
+    """Returns the boards and scores that would result from a move in every board, without spawning new tiles.
+
+    @param boards: an array of boards as 64 bit integers of 4 bit exponents
+    @param direction: the index in game.moves of the direction to move in
+    @return: the new boards and the score gained in each
+    """
+    transposed, table, scores = _directions[direction]
+    if transposed:
+        boards = transpose(boards)
+    new_boards = numpy.zeros_like(boards)
+    move_scores = numpy.zeros(boards.shape, dtype=numpy.int64)
+    for i in range(4):
+        rows = ((boards >> _row_shifts[i]) & 0xFFFF).astype(numpy.intp)
+        if transposed:
+            new_boards |= table[rows] << _shifts[i]
+        else:
+            new_boards |= table[rows] << _row_shifts[i]
+        move_scores += scores[rows]
+    return new_boards, move_scores
+
+
+def test_available_moves(boards):
+    """Tests whether or not there are available moves in each board.
+
+    @param boards: an array of boards as 64 bit integers of 4 bit exponents
+    @return: a mask of the boards with a legal move
+    """
+    available = (((boards[:, None] >> _shifts) & 0xF) == 0).any(axis=1)
+    # A full board can only be moved where two neighbouring tiles match, which a move left or up will find
+    full = numpy.flatnonzero(~available)
+    if full.size:
+        boards = boards[full]
+        available[full] = (move(boards, 0)[0] != boards) | (move(boards, 2)[0] != boards)
+    return available
+
+_stream_block = 256
+_shifts = numpy.arange(0, 64, 4, dtype=numpy.uint64)
+_row_shifts = numpy.arange(0, 64, 16, dtype=numpy.uint64)
+
+_tables = tables.load_tables()
+_score_left = _tables["score_left"].astype(numpy.int64)
+_score_right = _tables["score_right"].astype(numpy.int64)
+# For each direction index in game.moves: whether the board is transposed, and the move and score tables to use. The
+# tables for up and down moves place each row of the transposed board straight back as a column.
+_directions = [(False, _tables["left"].astype(numpy.uint64), _score_left),
+               (False, _tables["right"].astype(numpy.uint64), _score_right),
+               (True, tables.spread(_tables["left"]), _score_left),
+               (True, tables.spread(_tables["right"]), _score_right)]
@@ -0,0 +1,193 @@
+#!/usr/bin/env python
+import argparse
+import json
+import multiprocessing
+import numpy
+import os
+import platform
+import random
+import sys
+import time
+
+import batch_game
+import bitboard
+import controller
+import game
+import genetic
+
+
+def bench_moves(game_class, moves):
+    """Measures how fast a game carries out and tests moves, cycling through the directions on random positions.
+
+    @param game_class: the type of game, such as game.Game or bitboard.BitboardGame
+    @param moves: the number of moves to make
+    @return: a dictionary of the moves made and tested per second
+    """
+    g = game_class(random.Random(seed))
+    directions = [game.moves[i] for i in range(4)]
+    elapsed = 0.0
+    for i in range(moves):
+        if not g.get_playing():
+            g.new_game()
+        start = time.time()
+        g.make_move(directions[i % 4])
+        elapsed += time.time() - start
+
+    g.new_game()
+    start = time.time()
+    for i in range(moves):
+        g.test_move(directions[i % 4])
+    tested = time.time() - start
+    return {"make_move_per_second": moves / elapsed, "test_move_per_second": moves / tested}
+
+
+def bench_random_games(game_class, games):
+    """Measures how fast whole games are played with random legal moves.
+
+    @param game_class: the type of game, such as game.Game or bitboard.BitboardGame
+    @param games: the number of games to play
+    @return: a dictionary of the games and moves played per second
+    """
+    rng = random.Random(seed)
+    directions = [game.moves[i] for i in range(4)]
+    moves = 0
+    start = time.time()
+    for i in range(games):
+        g = game_class(random.Random(seed + i))
+        while g.get_playing():
+            legal = [d for d in directions if g.test_move(d)]
+            g.make_move(rng.choice(legal))
+            moves += 1
+    elapsed = time.time() - start
+    return {"games_per_second": games / elapsed, "moves_per_second": moves / elapsed}
+
+
+def bench_batch_games(games):
+    """Measures how fast a batch_game.BatchGame plays games with random moves.
+
+    @param games: the number of games to play at once
+    @return: a dictionary of the games and moves played per second
+    """
+    rng = numpy.random.RandomState(seed)
+    b = batch_game.BatchGame(games, seed=seed)
+    moves = 0
+    start = time.time()
+    while b.get_playing().any():
+        legal = b.test_moves()
+        choice = numpy.where(legal, rng.random_sample(legal.shape), -1).argmax(axis=1)
+        moves += b.make_move(choice)[1].sum()
+    elapsed = time.time() - start
+    return {"games_per_second": games / elapsed, "moves_per_second": moves / elapsed}
+
+
+def bench_activate(controller_class, hidden_list, calls):
+    """Measures the time taken by a controller's net to make one decision.
+
+    @param controller_class: the type of controller
+    @param hidden_list: the shape of the hidden layers in the net
+    @param calls: the number of times to activate the net
+    @return: a dictionary of the mean time per activation in microseconds
+    """
+    numpy.random.seed(seed)
+    cont = controller_class(4, hidden_list)
+    inputs = numpy.random.randint(0, 12, (calls, 16)).astype(float)
+    start = time.time()
+    for i in range(calls):
+        cont.net.activate(inputs[i])
+    elapsed = time.time() - start
+    return {"activate_microseconds": 1e6 * elapsed / calls}
+
+
+def bench_fitness(controller_class, hidden_list, num, repeats):
+    """Measures how fast controller.get_fitness plays games.
+
+    @param controller_class: the type of controller
+    @param hidden_list: the shape of the hidden layers in the net
+    @param num: the number of games in each fitness
+    @param repeats: the number of fitnesses to evaluate
+    @return: a dictionary of the games played per second
+    """
+    numpy.random.seed(seed)
+    random.seed(seed)
+    cont = controller_class(4, hidden_list)
+    start = time.time()
+    for i in range(repeats):
+        controller.get_fitness(cont, seeds=[seed + i * num + j for j in range(num)])
+    elapsed = time.time() - start
+    return {"games_per_second": num * repeats / elapsed}
+
+
+def bench_generation(controller_class, hidden_list, pop, proc, num, gen):
+    """Measures the wall time of each generation of genetic.run_breeding, with its output thrown away.
+
+    @param controller_class: the type of controller
+    @param hidden_list: the shape of the hidden layers in the net
+    @param pop: the number of nets in each generation
+    @param proc: the number of worker processes
+    @param num: the number of games in each fitness
+    @param gen: the number of generations to run
+    @return: a dictionary of the mean wall time per generation in seconds, including starting the workers
+    """
+    numpy.random.seed(seed)
+    random.seed(seed)
+    stdout = sys.stdout
+    sys.stdout = open(os.devnull, "w")
+    start = time.time()
+    try:
+        genetic.run_breeding(pop=pop, sel=max(2, pop // 10), grid_size=4, hidden_list=hidden_list, drift=0.1,
+                             sigma=0.1, gen=gen, num=num, proc=proc, controller_class=controller_class,
+                             common_seeds=True)
+    finally:
+        sys.stdout.close()
+        sys.stdout = stdout
+    return {"seconds_per_generation": (time.time() - start) / gen}
+
+
+def run_benchmarks(quick=False):
+    """Runs every benchmark.
+
+    @param quick: whether to run shorter benchmarks, for a rough check
+    @return: a dictionary of the results and of the machine they were measured on
+    """
+    scale = 10 if quick else 1
+    results = {"machine": {"python": platform.python_version(), "numpy": numpy.__version__,
+                           "platform": platform.platform(), "processors": multiprocessing.cpu_count()},
+               "seed": seed,
+               "quick": quick}
+
+    engines = [("Game", game.Game), ("BitboardGame", bitboard.BitboardGame)]
+    results["moves"] = dict((name, bench_moves(cls, 20000 // scale)) for name, cls in engines)
+    results["random_games"] = dict((name, bench_random_games(cls, 100 // scale)) for name, cls in engines)
+    results["random_games"]["BatchGame"] = bench_batch_games(1000 // scale)
+
+    controllers = [("Controller", controller.Controller), ("NumpyController", controller.NumpyController)]
+    results["activate"] = dict((name, bench_activate(cls, hidden_list, 5000 // scale)) for name, cls in controllers)
+    results["fitness"] = dict((name, bench_fitness(cls, hidden_list, 100 // scale, 5)) for name, cls in controllers)
+
+    results["generation"] = []
+    for pop in generation_pops:
+        for proc in generation_procs:
+            result = bench_generation(controller.NumpyController, hidden_list, pop // scale, proc, 100 // scale, 2)
+            result.update({"pop": pop // scale, "proc": proc})
+            results["generation"].append(result)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measures the speed of the games, controllers and evolution.")
+    parser.add_argument("-o", "--output", default="benchmark.json", help="the file to write the results to as JSON")
+    parser.add_argument("-q", "--quick", action="store_true", help="run shorter benchmarks for a rough check")
+    args = parser.parse_args()
+
+    results = run_benchmarks(args.quick)
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2, sort_keys=True)
+    print(json.dumps(results, indent=2, sort_keys=True))
+
+seed = 2048
+hidden_list = [16, 16]
+generation_pops = [50, 100]
+generation_procs = [1, 2, 4]
+
+if __name__ == "__main__":
+    main()
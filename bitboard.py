@@ -0,0 +1,257 @@
+import random
+
+import game
+import tables
+import utils
+
+
+class BitboardGame(object):
+    """A game of 2048 stored in a single 64 bit integer.
+
+    Each tile is held as a 4 bit exponent, with 0 for a free space and n for a tile of value 2**n. The tile at (x, y)
+    occupies bits 4*(4*y + x) to 4*(4*y + x) + 3, so each row of the grid is a 16 bit word with x = 0 in the lowest
+    nibble. Moves are carried out a row at a time through lookup tables, with up and down moves done by transposing
+    the board. The public interface matches game.Game.
+    """
+
+    def __init__(self, rng=None):
+        """Creates the game and sets up the board.
+
+        @param rng: the random number generator used to spawn tiles, such as a random.Random, or the random module if
+        none is given
+        """
+        if rng is None:
+            rng = random
+        self.rng = rng
+        # An object such as a trajectory.TrajectoryWriter to record each move with, or None
+        self.recorder = None
+        self.grid_size = 4
+        self.board = 0
+        self.playing = True
+        self.score = 0
+        self.new_game()
+
+    def game_over(self):
+        """Makes necessary changes for the end of a game."""
+        self.playing = False
+
+    def get_score(self):
+        """:returns the current score"""
+        return self.score
+
+    def get_playing(self):
+        """:returns whether the game is still playable"""
+        return self.playing
+
+    def get_tile(self, x, y):
+        """Returns the value of a specified tile, or 0 if it is free.
+
+        @param x: the x coordinate of the tile
+        @param y: the y coordinate of the tile
+        @return: the value of the specified tile, 0 or a power of two
+        """
+        exponent = (self.board >> (4 * (4 * y + x))) & 0xF
+        if exponent == 0:
+            return 0
+        return 1 << exponent
+
+    @property
+    def grid(self):
+        """The board as a list of columns, so that grid[x][y] is the value of the tile at (x, y)."""
+        return unpack_board(self.board)
+
+    @grid.setter
+    def grid(self, grid):
+        self.board = pack_grid(grid)
+
+    def make_move(self, direction):
+        """Carries out a move in the specified direction.
+
+        @param direction: left, right, up or down to specify the move direction
+        """
+        if direction not in _directions:
+            raise ValueError("%s is not a recognised direction" % direction)
+
+        if not self.playing:
+            raise utils.GameOverException("Attempting to make a move on a finished game")
+
+        old_board = self.board
+        board, move_score = self._move(direction)
+        valid = board != old_board
+        if valid:
+            self.board = board
+            self.score += move_score
+            shift, exponent = self._spawn_tile()
+
+        if not self.test_available_moves():
+            self.game_over()
+
+        if valid and self.recorder is not None:
+            self.recorder.record(old_board, game.move_indices[direction], shift // 4, exponent, self.score,
+                                 not self.playing)
+
+    def _move(self, direction):
+        """Returns the board and the score that would result from a move, without spawning a new tile.
+
+        @param direction: left, right, up or down to specify the move direction
+        @return: the new board and the score gained by the move
+        """
+        return move(self.board, direction)
+
+    def new_game(self):
+        """Creates a new game."""
+        self.score = 0
+        self.playing = True
+        self.board = 0
+        self._spawn_tile()
+        self._spawn_tile()
+
+    def _spawn_tile(self):
+        """Randomly spawns a new tile in an available space.
+
+        @return: the position of the new tile in the board as a shift in bits, and its exponent
+        """
+
+        if not self.playing:
+            raise utils.GameOverException("Attempting to make a spawn a tile for a finished game")
+
+        board = self.board
+        empty = _empty_mask(board)
+        # Clear the lowest set bits of the mask to reach a randomly chosen free space
+        for i in range(int(self.rng.random() * bin(empty).count("1"))):
+            empty &= empty - 1
+        shift = (empty & -empty).bit_length() - 1
+
+        if self.rng.random() < 0.1:
+            exponent = 2
+        else:
+            exponent = 1
+        self.board = board | (exponent << shift)
+        return shift, exponent
+
+    def test_available_moves(self):
+        """Tests whether or not there are available moves."""
+        if count_empty(self.board) > 0:
+            return True
+        # On a full board a move is only possible where two neighbouring tiles match, and a pair that can merge
+        # leftwards can also merge rightwards, so only one move along each axis needs testing
+        return self._move("left")[0] != self.board or self._move("up")[0] != self.board
+
+    def test_move(self, direction):
+        """Returns whether or not the move in the specified direction is legal.
+
+        @param direction: left, right, up or down to specify the move direction
+        """
+        if direction not in _directions:
+            raise ValueError("%s is not a recognised direction" % direction)
+
+        if not self.playing:
+            raise utils.GameOverException("Attempting to make a test a move for a finished game")
+
+        return self._move(direction)[0] != self.board
+
+
+def move(board, direction):
+    """Returns the board and the score that would result from a move on a 64 bit board, without spawning a new tile.
+
+    @param board: the board as an integer of 4 bit exponents
+    @param direction: left, right, up or down to specify the move direction
+    @return: the new board and the score gained by the move
+    """
+    transposed, table, scores = _directions[direction]
+    if transposed:
+        # The rows of the transposed board are the columns of the original, which the column tables put back
+        board = transpose(board)
+        r0 = board & 0xFFFF
+        r1 = (board >> 16) & 0xFFFF
+        r2 = (board >> 32) & 0xFFFF
+        r3 = board >> 48
+        new_board = table[r0] | (table[r1] << 4) | (table[r2] << 8) | (table[r3] << 12)
+    else:
+        r0 = board & 0xFFFF
+        r1 = (board >> 16) & 0xFFFF
+        r2 = (board >> 32) & 0xFFFF
+        r3 = board >> 48
+        new_board = table[r0] | (table[r1] << 16) | (table[r2] << 32) | (table[r3] << 48)
+    return new_board, scores[r0] + scores[r1] + scores[r2] + scores[r3]
+
+
+def pack_grid(grid):
+    """Packs a grid of tile values into a 64 bit board.
+
+    @param grid: a 4x4 list of columns of tile values, indexed as grid[x][y]
+    @return: the board as an integer of 4 bit exponents
+    """
+    board = 0
+    for x in range(4):
+        for y in range(4):
+            value = grid[x][y]
+            if value:
+                board |= (value.bit_length() - 1) << (4 * (4 * y + x))
+    return board
+
+
+def unpack_board(board):
+    """Unpacks a 64 bit board into a grid of tile values.
+
+    @param board: the board as an integer of 4 bit exponents
+    @return: a 4x4 list of columns of tile values, indexed as grid[x][y]
+    """
+    grid = [[0] * 4 for i in range(4)]
+    for x in range(4):
+        for y in range(4):
+            exponent = (board >> (4 * (4 * y + x))) & 0xF
+            if exponent:
+                grid[x][y] = 1 << exponent
+    return grid
+
+
+def transpose(board):
+    """Swaps the rows and columns of a 64 bit board.
+
+    @param board: the board as an integer of 4 bit exponents
+    @return: the transposed board
+    """
+    a1 = board & 0xF0F00F0FF0F00F0F
+    a2 = board & 0x0000F0F00000F0F0
+    a3 = board & 0x0F0F00000F0F0000
+    a = a1 | (a2 << 12) | (a3 >> 12)
+    b1 = a & 0xFF00FF0000FF00FF
+    b2 = a & 0x00FF00FF00000000
+    b3 = a & 0x00000000FF00FF00
+    return b1 | (b2 >> 24) | (b3 << 24)
+
+
+def count_empty(board):
+    """Returns the number of free spaces on a 64 bit board.
+
+    @param board: the board as an integer of 4 bit exponents
+    """
+    return bin(_empty_mask(board)).count("1")
+
+
+def _empty_mask(board):
+    """Returns an integer with the lowest bit of each free nibble on a 64 bit board set.
+
+    @param board: the board as an integer of 4 bit exponents
+    """
+    board |= board >> 2
+    board |= board >> 1
+    return ~board & 0x1111111111111111
+
+
+_tables = tables.load_tables()
+row_left = _tables["left"].tolist()
+row_right = _tables["right"].tolist()
+score_left = _tables["score_left"].tolist()
+score_right = _tables["score_right"].tolist()
+# The column tables hold the same results as the row tables, but placed so that a row of a transposed board can be
+# put straight back as a column
+col_left = tables.spread(_tables["left"]).tolist()
+col_right = tables.spread(_tables["right"]).tolist()
+
+# For each direction: whether the board is transposed, and the move and score tables to use
+_directions = {game.moves[0]: (False, row_left, score_left),
+               game.moves[1]: (False, row_right, score_right),
+               game.moves[2]: (True, col_left, score_left),
+               game.moves[3]: (True, col_right, score_right)}
@@ -0,0 +1,180 @@
+import cairo
+
+import utils
+
+
+class BoardPainter(object):
+    """Paints a game onto a cairo context, keeping the parts of the picture that do not change between draws.
+
+    The background and the grid lines are drawn once onto an offscreen surface, and each tile value is drawn with its
+    label onto a surface of its own the first time it appears. The board is kept on another surface built from these,
+    on which only the spaces whose tiles have changed since the last draw are painted again. Drawing a game is then a
+    matter of copying the board surface and writing the score.
+    """
+
+    def __init__(self, grid_size):
+        """Draws the background and the grid lines.
+
+        @param grid_size: the number of tiles along each side of the grid
+        """
+        self.grid_size = grid_size
+        self.grid_right = get_grid_right(grid_size)
+        self.grid_bottom = get_grid_bottom(grid_size)
+        self.width = self.grid_right + right_border
+        self.height = self.grid_bottom + bottom_border
+        self.background_rgb = get_rgb(background_color)
+        self.score_rgb = get_rgb(score_color)
+
+        self.static = cairo.ImageSurface(cairo.FORMAT_RGB24, self.width, self.height)
+        cr = cairo.Context(self.static)
+        cr.set_source_rgb(*self.background_rgb)
+        cr.paint()
+        cr.set_line_width(grid_line_width)
+        cr.set_source_rgb(*get_rgb(grid_color))
+        for i in range(grid_size + 1):
+            cr.move_to(grid_left + i * tile_size + (i - 0.5) * grid_line_width, grid_top - grid_line_width)
+            cr.line_to(grid_left + i * tile_size + (i - 0.5) * grid_line_width, self.grid_bottom - grid_line_width / 2)
+            cr.move_to(grid_left - grid_line_width, grid_top + i * tile_size + (i - 0.5) * grid_line_width)
+            cr.line_to(self.grid_right - grid_line_width / 2, grid_top + i * tile_size + (i - 0.5) * grid_line_width)
+        cr.stroke()
+
+        # The board starts as a copy of the static layer, with every space free
+        self.board = cairo.ImageSurface(cairo.FORMAT_RGB24, self.width, self.height)
+        self.board_context = cairo.Context(self.board)
+        self.board_context.set_source_surface(self.static, 0, 0)
+        self.board_context.paint()
+        self.painted = [[0] * grid_size for i in range(grid_size)]
+        self.tiles = {}
+
+    def paint(self, cr, grid, score):
+        """Paints a game.
+
+        @param cr: the cairo drawing context
+        @param grid: the values of the tiles, indexed as grid[x][y]
+        @param score: the score
+        """
+        for i in range(self.grid_size):
+            for j in range(self.grid_size):
+                if grid[i][j] != self.painted[i][j]:
+                    self._paint_space(i, j, grid[i][j])
+
+        cr.set_source_surface(self.board, 0, 0)
+        cr.paint()
+
+        cr.set_source_rgb(*self.score_rgb)
+        cr.select_font_face("Helvetica", cairo.FONT_SLANT_NORMAL, cairo.FONT_WEIGHT_BOLD)
+        cr.set_font_size(score_size)
+        (x, y, width, height, dx, dy) = cr.text_extents(str(score))
+        cr.move_to(self.grid_right - width - grid_line_width/2, top_border/2 + height/2)
+        cr.show_text(str(score))
+
+    def _paint_space(self, i, j, value):
+        """Paints a tile, or the background for a free space, onto the board surface.
+
+        @param i: the x coordinate of the space
+        @param j: the y coordinate of the space
+        @param value: the value of the tile, or 0 for a free space
+        """
+        cr = self.board_context
+        left = grid_left + grid_line_width * i + tile_size * i
+        top = grid_top + grid_line_width * j + tile_size * j
+        if value == 0:
+            cr.set_source_rgb(*self.background_rgb)
+            cr.rectangle(left, top, tile_size, tile_size)
+            cr.fill()
+        else:
+            cr.set_source_surface(self._get_tile(value), left, top)
+            cr.paint()
+        self.painted[i][j] = value
+
+    def _get_tile(self, value):
+        """Returns a surface holding a tile with its label, drawing it the first time the value is needed.
+
+        @param value: the value of the tile
+        """
+        tile = self.tiles.get(value)
+        if tile is None:
+            tile = cairo.ImageSurface(cairo.FORMAT_RGB24, tile_size, tile_size)
+            cr = cairo.Context(tile)
+            cr.set_source_rgb(*get_rgb(tile_colors.get(value, high_tile_color)))
+            cr.paint()
+
+            cr.set_source_rgb(*get_rgb(label_color[label_dict.get(value, 1)]))
+            cr.select_font_face("Helvetica", cairo.FONT_SLANT_NORMAL, cairo.FONT_WEIGHT_BOLD)
+            cr.set_font_size(label_font_size.get(value, high_label_font_size))
+            (x, y, width, height, dx, dy) = cr.text_extents(str(value))
+            cr.move_to(tile_size * 0.5 - width / 2, tile_size * 0.5 + height / 2)
+            cr.show_text(str(value))
+            self.tiles[value] = tile
+        return tile
+
+
+def get_rgb(color):
+    """Returns the components of a colour as floats between 0 and 1.
+
+    @param color: the utils.HexColor
+    @return: a tuple of the red, green and blue components
+    """
+    return color.get_red_f(), color.get_green_f(), color.get_blue_f()
+
+
+def get_grid_right(grid_size):
+    """Returns the x coordinate of the right edge of the grid.
+
+    @param grid_size: the number of tiles along each side of the grid
+    """
+    return left_border + grid_size * tile_size + (grid_size + 1) * grid_line_width
+
+
+def get_grid_bottom(grid_size):
+    """Returns the y coordinate of the bottom edge of the grid.
+
+    @param grid_size: the number of tiles along each side of the grid
+    """
+    return top_border + grid_size * tile_size + (grid_size + 1) * grid_line_width
+
+background_color = utils.HexColor("0xEDEDED")
+grid_color = utils.HexColor("0xBBADA0")
+score_color = utils.HexColor("0x776E65")
+score_size = 40
+square_color = utils.HexColor("0xCDC1B4")
+label_color = [utils.HexColor("0x776E65"), utils.HexColor("0xF9F6F2")]
+label_dict = {2 ** i: 1 for i in range(3, 18)}
+label_dict[2] = 0
+label_dict[4] = 0
+label_font_size = {2: 60, 4: 60, 8: 60,
+                   16: 40, 32: 40, 64: 40,
+                   128: 30, 256: 30, 512: 30,
+                   1024: 25, 2048: 25, 4096: 25, 8192: 25,
+                   16384: 20, 32768: 20, 65536: 20,
+                   131072: 20}
+# Larger tiles, which only bigger grids can reach
+high_label_font_size = 16
+tile_colors = {2: utils.HexColor("0xEEE4DA"),
+               4: utils.HexColor("0xEDE0C8"),
+               8: utils.HexColor("0xF2B179"),
+               16: utils.HexColor("0xF59563"),
+               32: utils.HexColor("0xF67C5F"),
+               64: utils.HexColor("0xF65E3B"),
+               128: utils.HexColor("0xEDCF72"),
+               256: utils.HexColor("0xEDCC61"),
+               512: utils.HexColor("0xEDC850"),
+               1024: utils.HexColor("0xEDC53F"),
+               2048: utils.HexColor("0xEDC22E"),
+               4096: utils.HexColor("0x3C3A32"),
+               8192: utils.HexColor("0x3C3A32"),
+               16384: utils.HexColor("0x3C3A32"),
+               32768: utils.HexColor("0x3C3A32"),
+               65536: utils.HexColor("0x3C3A32"),
+               131072: utils.HexColor("0x3C3A32")}
+high_tile_color = utils.HexColor("0x3C3A32")
+
+grid_line_width = 20
+tile_size = 80
+top_border = 50 + grid_line_width
+bottom_border = 50
+left_border = 50 + grid_line_width
+right_border = 50
+
+grid_left = left_border + grid_line_width / 2
+grid_top = top_border + grid_line_width / 2
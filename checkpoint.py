@@ -0,0 +1,102 @@
+import json
+import pickle
+import threading
+import numpy
+
+import utils
+
+
+class Checkpointer(object):
+    """Writes checkpoints of a run to a file from a background thread, so that the run does not wait for the disk.
+
+    Each checkpoint replaces the previous one atomically. If checkpoints are requested faster than they can be
+    written, only the most recent waiting one is written.
+    """
+
+    def __init__(self, path):
+        """Starts the writing thread.
+
+        @param path: the file to write checkpoints to
+        """
+        self.path = path
+        self.pending = None
+        self.closed = False
+        self.error = None
+        self.condition = threading.Condition()
+        self.thread = threading.Thread(target=self._write_loop)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def save(self, state):
+        """Queues a checkpoint to be written.
+
+        @param state: the state to save, as described in write_checkpoint. The arrays are copied, so the caller may
+        go on changing them.
+        """
+        state = dict((key, numpy.array(value, copy=True)) if isinstance(value, numpy.ndarray) else (key, value)
+                     for key, value in state.items())
+        with self.condition:
+            self._raise_error()
+            self.pending = state
+            self.condition.notify()
+
+    def close(self):
+        """Waits for any queued checkpoint to be written and stops the writing thread."""
+        with self.condition:
+            self.closed = True
+            self.condition.notify()
+        self.thread.join()
+        self._raise_error()
+
+    def _raise_error(self):
+        """Raises any error from writing the last checkpoint in the calling thread."""
+        if self.error is not None:
+            error, self.error = self.error, None
+            raise error
+
+    def _write_loop(self):
+        """Writes queued checkpoints until the checkpointer is closed."""
+        while True:
+            with self.condition:
+                while self.pending is None and not self.closed:
+                    self.condition.wait()
+                state, self.pending = self.pending, None
+                if state is None:
+                    return
+            try:
+                write_checkpoint(self.path, state)
+            except Exception as e:
+                self.error = e
+
+
+def write_checkpoint(path, state):
+    """Writes a checkpoint to a file.
+
+    The checkpoint is an uncompressed .npz file, replacing any previous one atomically with utils.atomic_write.
+
+    @param path: the file to write to
+    @param state: a dictionary holding the run configuration under config, which must be serialisable as JSON, the
+    states of the random module and of numpy.random under random_state and numpy_state, and arrays of numbers under
+    any other keys
+    """
+    arrays = dict((key, numpy.asarray(value)) for key, value in state.items()
+                  if key not in ("config", "random_state", "numpy_state"))
+    arrays["config"] = numpy.array(json.dumps(state["config"]))
+    for key in ("random_state", "numpy_state"):
+        arrays[key] = numpy.frombuffer(pickle.dumps(state[key], 2), dtype=numpy.uint8)
+
+    utils.atomic_write(path, lambda f: numpy.savez(f, **arrays))
+
+
+def read_checkpoint(path):
+    """Reads a checkpoint written by write_checkpoint.
+
+    @param path: the file to read from
+    @return: the state, as passed to write_checkpoint
+    """
+    with numpy.load(path) as f:
+        state = dict((key, f[key]) for key in f.files)
+    state["config"] = json.loads(str(state["config"]))
+    for key in ("random_state", "numpy_state"):
+        state[key] = pickle.loads(state[key].tobytes())
+    return state
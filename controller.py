@@ -1,9 +1,11 @@
+import batch_game
 import game
+import numpy
 from numpy import where
 from pybrain.structure import FeedForwardNetwork
 from pybrain.structure import FullConnection
 from pybrain.structure import LinearLayer, SigmoidLayer
-import random
+from scipy.special import expit
 
 
 class Controller(object):
@@ -15,6 +17,8 @@ class Controller(object):
         @param grid_size: the size of the grid, for specifying the input layer.
         @param hidden_list: a list containing the number of nodes in each hidden layer.
         """
+        self.grid_size = grid_size
+        self.sizes = [grid_size*grid_size] + list(hidden_list) + [4]
         self.net = FeedForwardNetwork()
 
         in_layer = LinearLayer(grid_size*grid_size)
@@ -29,9 +33,8 @@ class Controller(object):
             self.net.addModule(hidden_layer)
 
         self.net.addConnection(FullConnection(in_layer, hidden_layers[0]))
-        if len(hidden_layers) > 1:
-            for i in range(1, len(hidden_layers) - 1):
-                self.net.addConnection(FullConnection(hidden_layers[i], hidden_layers[i+1]))
+        for i in range(len(hidden_layers) - 1):
+            self.net.addConnection(FullConnection(hidden_layers[i], hidden_layers[i+1]))
         self.net.addConnection(FullConnection(hidden_layers[-1], out_layer))
 
         self.net.sortModules()
@@ -41,21 +44,185 @@ class Controller(object):
 
         @param drift scales the size of mutation to apply
         """
-        for i in range(self.net.params.size):
-            self.net.params[i] += (random.random() - 0.5) * drift
+        self.net.params[:] += (numpy.random.random_sample(self.net.params.size) - 0.5) * drift
 
+    def get_decision(self, g):
+        """Returns how strongly the net favours each move in a game.
 
-def run_game(cont):
+        @param g: the game being played
+        @return: an array with a value for each move in game.moves, highest for the preferred move
+        """
+        input_list = [item for sub in g.grid for item in sub]
+        return self.net.activate(input_list)
+
+
+class NumpyController(Controller):
+    """A neural net for deciding which step to take next, evaluated directly with NumPy rather than PyBrain."""
+
+    def __init__(self, grid_size, hidden_list):
+        """Sets up the neural network.
+
+        @param grid_size: the size of the grid, for specifying the input layer.
+        @param hidden_list: a list containing the number of nodes in each hidden layer.
+        """
+        self.grid_size = grid_size
+        self.sizes = [grid_size*grid_size] + list(hidden_list) + [4]
+        self.net = NumpyNetwork(self.sizes)
+        self.net.params[:] = numpy.random.randn(self.net.params.size)
+
+
+class NumpyNetwork(object):
+    """A feed forward network with a linear input layer, sigmoid hidden layers and a linear output layer.
+
+    The parameters are held in a single float32 vector with the same layout as the FeedForwardNetwork built by
+    Controller: the weights of each connection in turn from the input layer, indexed by output node then input node.
+    The weight matrix of each connection is a contiguous view into this vector, so changes to params take effect
+    without any copying. A single input is activated in preallocated buffers, so that the overhead of each call is
+    small next to the arithmetic.
+    """
+
+    def __init__(self, sizes, params=None):
+        """Sets up the network.
+
+        @param sizes: the number of nodes in each layer, from the input layer to the output layer
+        @param params: the initial parameters, zero if not given
+        """
+        self.sizes = list(sizes)
+        size = sum(self.sizes[i] * self.sizes[i + 1] for i in range(len(self.sizes) - 1))
+        if params is None:
+            self.params = numpy.zeros(size, dtype=numpy.float32)
+        else:
+            self.params = numpy.array(params, dtype=numpy.float32)
+            if self.params.shape != (size,):
+                raise ValueError("Expected %i parameters for the layer sizes %s" % (size, self.sizes))
+        self.sortModules()
+
+    def sortModules(self):
+        """Sets up the weight matrix of each connection as a view into params."""
+        self.weights = []
+        offset = 0
+        for i in range(len(self.sizes) - 1):
+            size = self.sizes[i] * self.sizes[i + 1]
+            self.weights.append(self.params[offset:offset + size].reshape(self.sizes[i + 1], self.sizes[i]))
+            offset += size
+        # The input and the output of each layer for a single input, with the weights and buffers of each hidden layer
+        self.buffers = [numpy.zeros(n, dtype=numpy.float32) for n in self.sizes]
+        self.hidden = list(zip(self.weights[:-1], self.buffers[:-2], self.buffers[1:-1]))
+
+    def copy(self):
+        """Returns a copy of the network with its own parameters."""
+        return NumpyNetwork(self.sizes, self.params)
+
+    def __getstate__(self):
+        """Returns the layer sizes and parameters, which are all that pickle and copy.deepcopy need to keep.
+
+        The weights and buffers are left out, since copied separately the weights would no longer be views into params.
+        """
+        return {"sizes": self.sizes, "params": self.params}
+
+    def __setstate__(self, state):
+        """Restores the network from __getstate__, setting the weights up again as views into params."""
+        self.sizes = list(state["sizes"])
+        self.params = numpy.array(state["params"], dtype=numpy.float32)
+        self.sortModules()
+
+    def activate(self, inp):
+        """Returns the output of the network.
+
+        @param inp: a single input, or a batch of inputs with one per row
+        @return: the output for the input, or an array with the output for each input in the batch
+        """
+        if getattr(inp, "ndim", 1) == 1 and not isinstance(inp[0], (list, tuple, numpy.ndarray)):
+            buffers = self.buffers
+            buffers[0][:] = inp
+            for w, layer_in, layer_out in self.hidden:
+                numpy.dot(w, layer_in, out=layer_out)
+                expit(layer_out, out=layer_out)
+            return numpy.dot(self.weights[-1], buffers[-2])
+
+        out = numpy.asarray(inp, dtype=numpy.float32)
+        for w in self.weights[:-1]:
+            out = sigmoid(numpy.dot(out, w.T))
+        return numpy.dot(out, self.weights[-1].T)
+
+
+class PopulationNetwork(object):
+    """The nets of a population of controllers with the same shape, evaluated together.
+
+    The parameters of the P nets are stacked into a (P, n) float32 matrix, with each row laid out as for NumpyNetwork.
+    The weights of each connection form a (P, out, in) view into it, so one batched matrix product per layer
+    evaluates every net on its own inputs.
+    """
+
+    def __init__(self, sizes, params):
+        """Sets up the networks.
+
+        @param sizes: the number of nodes in each layer, from the input layer to the output layer
+        @param params: the parameters of each net, one per row
+        """
+        self.sizes = list(sizes)
+        size = sum(self.sizes[i] * self.sizes[i + 1] for i in range(len(self.sizes) - 1))
+        self.params = numpy.array(params, dtype=numpy.float32)
+        if self.params.ndim != 2 or self.params.shape[1] != size:
+            raise ValueError("Expected %i parameters per net for the layer sizes %s" % (size, self.sizes))
+
+        self.weights = []
+        offset = 0
+        for i in range(len(self.sizes) - 1):
+            size = self.sizes[i] * self.sizes[i + 1]
+            self.weights.append(self.params[:, offset:offset + size].reshape(-1, self.sizes[i + 1], self.sizes[i]))
+            offset += size
+
+    def activate(self, inp):
+        """Returns the output of every net.
+
+        @param inp: an array of shape (P, B, in) holding a batch of B inputs for each net
+        @return: an array of shape (P, B, out) holding the output of each net for each of its inputs
+        """
+        out = numpy.asarray(inp, dtype=numpy.float32)
+        for w in self.weights[:-1]:
+            out = sigmoid(numpy.matmul(out, w.transpose(0, 2, 1)))
+        return numpy.matmul(out, self.weights[-1].transpose(0, 2, 1))
+
+
+def stack_population(population):
+    """Stacks the nets of several controllers into a single PopulationNetwork.
+
+    @param population: a list of controllers, which must all have nets of the same shape
+    @return: the stacked nets
+    """
+    sizes = population[0].sizes
+    for cont in population:
+        if cont.sizes != sizes:
+            raise ValueError("Can't stack nets: they are not the same shape")
+    return PopulationNetwork(sizes, [cont.net.params for cont in population])
+
+
+def sigmoid(x):
+    """Replaces an array with its logistic sigmoid, which does not overflow for large inputs.
+
+    @param x: the array, which is overwritten
+    @return: the array
+    """
+    return expit(x, out=x)
+
+
+def run_game(cont, g=None, recorder=None):
     """Runs a game and returns the score.
 
-    @param cont: the controller to test
+    @param cont: the controller to test, which may be any object with a get_decision method like Controller's
+    @param g: the game to play, which may be any object with the interface of game.Game. A new game.Game with the
+    controller's grid size is used if none is given.
+    @param recorder: a trajectory.TrajectoryWriter to record each move of the game with, or None
     @return the score of the game
     """
-    g = game.Game()
+    if g is None:
+        g = game.Game(grid_size=getattr(cont, "grid_size", 4))
+    if recorder is not None:
+        g.recorder = recorder
 
     while g.get_playing():
-        input_list = [item for sub in g.grid for item in sub]
-        decision = cont.net.activate(input_list)
+        decision = cont.get_decision(g)
         for i in range(4):
             direction = where(decision == max(decision))[0][0]
             if g.test_move(game.moves[direction]):
@@ -67,22 +234,117 @@ def run_game(cont):
     return g.get_score()
 
 
-def get_fitness(cont):
+def run_batch(cont, num, seed=None, seeds=None):
+    """Runs several games at once and returns their scores.
+
+    Each game makes the same choices as in run_game, but the net is evaluated for every game still playing in one
+    call, so it must accept a batch of inputs as NumpyNetwork does. The games are played on 4x4 grids.
+
+    @param cont: the controller to test
+    @param num: the number of games to play
+    @param seed: seed for spawning tiles in the games
+    @param seeds: a seed for each game instead, so that each game spawns tiles from its own stream
+    @return: an array of the score of each game
+    """
+    g = batch_game.BatchGame(num, seed, seeds)
+
+    while g.get_playing().any():
+        playing = numpy.flatnonzero(g.get_playing())
+        inputs = g.get_grids()[playing].reshape(playing.size, g.grid_size * g.grid_size)
+        decisions = numpy.full((num, 4), -numpy.inf)
+        decisions[playing] = cont.net.activate(inputs)
+        decisions[~g.test_moves()] = -numpy.inf
+        g.make_move(decisions.argmax(axis=1))
+
+    return g.get_scores()
+
+
+def run_population(population, num, seed=None, seeds=None):
+    """Runs several games for each of a population of controllers, playing every game at once.
+
+    Each game makes the same choices as in run_game. All of the nets are evaluated together through a
+    PopulationNetwork, so the population plays one synchronised move at a time. The games are played on 4x4 grids.
+
+    @param population: a list of controllers, which must all have nets of the same shape
+    @param num: the number of games for each controller to play
+    @param seed: seed for spawning tiles in the games
+    @param seeds: a seed for each of the num games instead, so that every controller's game with the same index spawns
+    tiles from the same stream
+    @return: an array of shape (P, num) holding the score of each game
+    """
+    nets = stack_population(population)
+    size = len(population)
+    if seeds is not None:
+        seeds = list(seeds) * size
+    g = batch_game.BatchGame(size * num, seed, seeds)
+
+    while g.get_playing().any():
+        inputs = g.get_grids().reshape(size, num, g.grid_size * g.grid_size)
+        decisions = nets.activate(inputs).reshape(size * num, 4)
+        decisions[~g.test_moves()] = -numpy.inf
+        g.make_move(decisions.argmax(axis=1))
+
+    return g.get_scores().reshape(size, num)
+
+
+def get_population_fitness(population, seeds=None):
+    """
+    Runs several games for each controller in a population to get an average score for each fitness.
+
+    @param population: a list of controllers, which must all have nets of the same shape
+    @param seeds: a seed for each game to play, as for get_fitness
+    @return fitnesses: a list of the average score of each controller
+    """
+    if seeds is not None:
+        return run_population(population, len(seeds), seeds=seeds).mean(axis=1).tolist()
+    if get_num() == 0:
+        raise ValueError("The number of games to average fitness over has not been set.")
+    return run_population(population, get_num()).mean(axis=1).tolist()
+
+
+def get_scores(cont, num, seeds=None):
+    """
+    Runs several games and returns the score of each.
+
+    @param cont: the controller to test
+    @param num: the number of games to play
+    @param seeds: a seed for each game, as for get_fitness. A seeded game spawns the same tiles whether it is played
+    alone or in a batch, so its score does not depend on how many games are played.
+    @return scores: a list of the score of each game
+    """
+    if isinstance(cont.net, NumpyNetwork) and cont.grid_size == 4 and num >= batch_threshold:
+        return run_batch(cont, num, seeds=seeds).tolist()
+    scores = []
+    for i in range(num):
+        if seeds is None:
+            scores.append(run_game(cont))
+        else:
+            scores.append(run_game(cont, game.Game(batch_game.SpawnStream(seeds[i]), cont.grid_size)))
+    return scores
+
+
+def get_fitness(cont, seeds=None):
     """
     Runs several games to get an average score for the fitness.
 
     @param cont: the controller to test
+    @param seeds: a seed for each game to play. Controllers given the same seeds play games with the same streams of
+    random spawns, so that differences in their fitness come from the controllers rather than the luck of the
+    games. By default get_num() games are played with the global random number generator.
     @return fitness: the average score
     """
-    if get_num() == 0:
-        raise ValueError("The number of games to average fitness over has not been set.")
-    fitness = 0
-    for i in range(get_num()):
-        fitness += run_game(cont)
-    fitness /= get_num()
-    return fitness
+    if seeds is None:
+        if get_num() == 0:
+            raise ValueError("The number of games to average fitness over has not been set.")
+        n = get_num()
+    else:
+        n = len(seeds)
+    return float(sum(get_scores(cont, n, seeds))) / n
 
 num = 0
+# The smallest number of games for which get_fitness plays the games of a NumPy net together with run_batch. Each move
+# of a batch has a fixed cost of a few hundred microseconds, so fewer games are quicker to play one at a time.
+batch_threshold = 20
 
 
 def set_num(n):
@@ -0,0 +1,207 @@
+from collections import OrderedDict
+import numpy
+import time
+
+import bitboard
+import game
+
+
+class ExpectimaxController(object):
+    """A controller that chooses moves by an expectimax search over moves and randomly spawned tiles.
+
+    Each move is searched to a fixed depth of moves, taking the expectation over every free space and both spawned
+    tiles at each chance node, with a 2 spawning with probability 0.9 and a 4 with probability 0.1 as in game.Game.
+    Positions reached with a low enough probability are evaluated directly by the heuristic rather than searched.
+    Searched chance nodes are kept in a transposition table of bounded size, from which the least recently used
+    positions are evicted. The search deepens one move at a time up to the full depth, and stops early with the
+    result of the last complete depth if the budget of nodes or time for the move runs out.
+
+    Use it in place of a Controller in controller.run_game.
+    """
+
+    def __init__(self, depth=3, max_nodes=None, max_time=None, table_size=100000, min_probability=0.0001):
+        """Sets up the search.
+
+        @param depth: the number of moves to search ahead
+        @param max_nodes: the most chance nodes to search for a move, or None for no limit
+        @param max_time: the most time to spend searching for a move in seconds, or None for no limit
+        @param table_size: the most positions to keep in the transposition table
+        @param min_probability: positions reached with a lower probability than this are not searched further
+        """
+        self.depth = depth
+        self.max_nodes = max_nodes
+        self.max_time = max_time
+        self.table_size = table_size
+        self.min_probability = min_probability
+        self.table = OrderedDict()
+        self.nodes = 0
+        self.deadline = None
+        self.heuristic = get_heuristic_table()
+
+    def get_decision(self, g):
+        """Returns the expected value of each move in a game.
+
+        @param g: the game being played, which must be 4x4
+        @return: an array with a value for each move in game.moves, -inf for an illegal move
+        """
+        board = getattr(g, "board", None)
+        if board is None:
+            if len(g.grid) != 4:
+                raise ValueError("%s only plays 4x4 games" % type(self).__name__)
+            board = bitboard.pack_grid(g.grid)
+
+        self.nodes = 0
+        if self.max_time is not None:
+            self.deadline = time.time() + self.max_time
+        else:
+            self.deadline = None
+
+        decision = self._search_moves(board, 1, False)
+        for depth in range(2, self.depth + 1):
+            try:
+                decision = self._search_moves(board, depth, True)
+            except _BudgetExceeded:
+                break
+        return numpy.array(decision)
+
+    def _search_moves(self, board, depth, limited):
+        """Returns the expected value of each move from a position.
+
+        @param board: the position as a 64 bit board
+        @param depth: the number of moves to search ahead
+        @param limited: whether to stop if the budget for the move runs out
+        @return: a list with a value for each move in game.moves, -inf for an illegal move
+        """
+        values = []
+        for i in range(4):
+            new_board = bitboard.move(board, game.moves[i])[0]
+            if new_board == board:
+                values.append(-numpy.inf)
+            else:
+                values.append(self._chance_node(new_board, depth - 1, 1.0, limited))
+        return values
+
+    def _move_node(self, board, depth, probability, limited):
+        """Returns the value of a position with the player to move, the best value of any legal move.
+
+        @param board: the position as a 64 bit board
+        @param depth: the number of moves left to search
+        @param probability: the probability of reaching the position
+        @param limited: whether to stop if the budget for the move runs out
+        """
+        best = 0
+        for direction in _directions:
+            new_board = bitboard.move(board, direction)[0]
+            if new_board != board:
+                best = max(best, self._chance_node(new_board, depth - 1, probability, limited))
+        return best
+
+    def _chance_node(self, board, depth, probability, limited):
+        """Returns the value of a position before a tile is spawned, the average over every possible spawn.
+
+        @param board: the position as a 64 bit board
+        @param depth: the number of moves left to search
+        @param probability: the probability of reaching the position
+        @param limited: whether to stop if the budget for the move runs out
+        """
+        if depth <= 0 or probability < self.min_probability:
+            return self._evaluate(board)
+
+        entry = self.table.pop(board, None)
+        if entry is not None:
+            # Put the entry back at the end, as the most recently used
+            self.table[board] = entry
+            if entry[0] >= depth:
+                return entry[1]
+
+        self.nodes += 1
+        if limited:
+            if self.max_nodes is not None and self.nodes > self.max_nodes:
+                raise _BudgetExceeded()
+            if self.deadline is not None and self.nodes % 256 == 0 and time.time() > self.deadline:
+                raise _BudgetExceeded()
+
+        empty = bitboard.count_empty(board)
+        probability /= empty
+        value = 0.0
+        for shift in range(0, 64, 4):
+            if (board >> shift) & 0xF == 0:
+                value += 0.9 * self._move_node(board | (1 << shift), depth, probability * 0.9, limited)
+                value += 0.1 * self._move_node(board | (2 << shift), depth, probability * 0.1, limited)
+        value /= empty
+
+        self.table[board] = (depth, value)
+        if len(self.table) > self.table_size:
+            self.table.popitem(last=False)
+        return value
+
+    def _evaluate(self, board):
+        """Returns the heuristic value of a position, from both its rows and its columns.
+
+        @param board: the position as a 64 bit board
+        """
+        h = self.heuristic
+        t = bitboard.transpose(board)
+        return (h[board & 0xFFFF] + h[(board >> 16) & 0xFFFF] + h[(board >> 32) & 0xFFFF] + h[board >> 48] +
+                h[t & 0xFFFF] + h[(t >> 16) & 0xFFFF] + h[(t >> 32) & 0xFFFF] + h[t >> 48])
+
+
+class _BudgetExceeded(Exception):
+    """Raised to abandon a search when the budget for the move has run out."""
+
+
+def get_heuristic_table():
+    """Returns the heuristic value of every possible 16 bit row, building the table the first time it is needed.
+
+    A row scores highly for free spaces, for neighbouring tiles that can merge and for tiles that increase or
+    decrease steadily along it, and loses value for large tiles, which encourages merging them.
+
+    @return: a list of the value of each row
+    """
+    global _heuristic
+    if _heuristic is None:
+        _heuristic = []
+        for row in range(65536):
+            line = [(row >> (4 * i)) & 0xF for i in range(4)]
+
+            empty = line.count(0)
+            total = sum(e ** sum_power for e in line)
+
+            merges = 0
+            previous = 0
+            counter = 0
+            for e in line:
+                if e == 0:
+                    continue
+                if previous == e:
+                    counter += 1
+                elif counter > 0:
+                    merges += 1 + counter
+                    counter = 0
+                previous = e
+            if counter > 0:
+                merges += 1 + counter
+
+            monotonicity_left = 0
+            monotonicity_right = 0
+            for i in range(1, 4):
+                if line[i - 1] > line[i]:
+                    monotonicity_left += line[i - 1] ** monotonicity_power - line[i] ** monotonicity_power
+                else:
+                    monotonicity_right += line[i] ** monotonicity_power - line[i - 1] ** monotonicity_power
+
+            _heuristic.append(lost_penalty + empty_weight * empty + merges_weight * merges -
+                              monotonicity_weight * min(monotonicity_left, monotonicity_right) - sum_weight * total)
+    return _heuristic
+
+# Weights of the row heuristic
+lost_penalty = 200000.0
+empty_weight = 270.0
+merges_weight = 700.0
+monotonicity_power = 4
+monotonicity_weight = 47.0
+sum_power = 3.5
+sum_weight = 11.0
+
+_directions = [game.moves[i] for i in range(4)]
+_heuristic = None
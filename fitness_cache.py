@@ -0,0 +1,98 @@
+from collections import OrderedDict
+import hashlib
+import numpy
+import os
+import pickle
+
+import utils
+
+
+class FitnessCache(object):
+    """A bounded cache of fitnesses, so that a controller evaluated on the same games is not evaluated again.
+
+    Fitnesses are keyed by a hash of the controller's parameters, the shape of its net and the games it played. When
+    the cache is full the least recently used fitness is dropped. The cache can be saved to a file and loaded again,
+    so that it carries over between runs.
+    """
+
+    def __init__(self, max_size=10000, path=None):
+        """Creates the cache, loading it from a file if one is given and exists.
+
+        @param max_size: the most fitnesses to keep
+        @param path: the file to load the cache from and save it to, or None to keep it in memory only
+        """
+        self.max_size = max_size
+        self.path = path
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        if path is not None and os.path.isfile(path):
+            with open(path, "rb") as f:
+                self.entries = pickle.load(f)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    def get(self, key):
+        """Returns a cached fitness, or None if there is none for the key.
+
+        @param key: the key from make_key
+        """
+        fitness = self.entries.pop(key, None)
+        if fitness is None:
+            self.misses += 1
+            return None
+        # Put the entry back at the end, as the most recently used
+        self.entries[key] = fitness
+        self.hits += 1
+        return fitness
+
+    def put(self, key, fitness):
+        """Adds a fitness to the cache.
+
+        @param key: the key from make_key
+        @param fitness: the fitness
+        """
+        self.entries.pop(key, None)
+        self.entries[key] = fitness
+        if len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+    def get_hit_rate(self):
+        """Returns the fraction of lookups that found a fitness, or 0 if there have been none."""
+        lookups = self.hits + self.misses
+        if lookups == 0:
+            return 0.0
+        return float(self.hits) / lookups
+
+    def get_stats(self):
+        """Returns a dictionary of the number of hits, misses and entries, and the hit rate."""
+        return {"hits": self.hits, "misses": self.misses, "entries": len(self.entries),
+                "hit_rate": self.get_hit_rate()}
+
+    def save(self):
+        """Writes the cache to its file, if it has one, replacing the file atomically."""
+        if self.path is None:
+            return
+        utils.atomic_write(self.path, lambda f: pickle.dump(self.entries, f, 2))
+
+
+def make_key(params, sizes, seeds, num):
+    """Returns the cache key for evaluating a controller on a set of games.
+
+    @param params: the parameters of the controller's net, as an array
+    @param sizes: the number of nodes in each layer of the net
+    @param seeds: the seeds of the games. Unseeded games cannot be cached, as their fitness is not repeatable.
+    @param num: the number of games
+    @return: the key, as a string
+    """
+    if seeds is None:
+        raise ValueError("Only fitnesses of seeded games can be cached")
+    h = hashlib.sha1()
+    h.update(str(params.dtype).encode("ascii"))
+    h.update(params.tobytes())
+    h.update(repr(list(sizes)).encode("ascii"))
+    # The seeds are hashed as fixed width integers, as their repr differs between int and long, and so between a run
+    # and the same run resumed from a checkpoint
+    h.update(numpy.asarray(seeds, dtype=numpy.uint64).tobytes())
+    h.update(str(int(num)).encode("ascii"))
+    return h.hexdigest()
@@ -1,17 +1,37 @@
+from collections import deque
 import copy
 import random
+
+import tables
 import utils
 
 
 class Game(object):
     """A game of 2048."""
 
-    def __init__(self):
-        """Creates the game and sets up the board."""
-        self.grid_size = 4
+    def __init__(self, rng=None, grid_size=4, undo_limit=0):
+        """Creates the game and sets up the board.
+
+        @param rng: the random number generator used to spawn tiles, such as a random.Random. Games given generators
+        seeded alike spawn the same tiles for the same moves. The random module is used if none is given.
+        @param grid_size: the number of tiles along each side of the grid, from min_grid_size to max_grid_size
+        @param undo_limit: the most moves that can be undone, or 0 to keep no history of moves
+        """
+        if not min_grid_size <= grid_size <= max_grid_size:
+            raise ValueError("Grid size %i is not between %i and %i" % (grid_size, min_grid_size, max_grid_size))
+        if rng is None:
+            rng = random
+        self.rng = rng
+        # An object such as a trajectory.TrajectoryWriter to record each move with, or None
+        self.recorder = None
+        self.grid_size = grid_size
         self.grid = [[i*j*0 for i in range(self.grid_size)] for j in range(self.grid_size)]
         self.playing = True
         self.score = 0
+        # Snapshots from fork of the positions before each move that can be undone, and after each undone move
+        self.undo_limit = undo_limit
+        self.undo_stack = deque(maxlen=undo_limit)
+        self.redo_stack = []
         self.new_game()
 
     def game_over(self):
@@ -19,7 +39,7 @@ class Game(object):
         self.playing = False
 
     def _get_sequences(self, direction):
-        """Returns the four sequences in order for the specified move."""
+        """Returns the sequences in order for the specified move, one for each row or column of the grid."""
         if direction == "left":
             seqs = [Sequence(self.grid_size, [self.grid[i][j] for i in range(self.grid_size)]) for j in
                     range(self.grid_size)]
@@ -36,6 +56,27 @@ class Game(object):
             raise ValueError("%s is not a recognised direction" % direction)
         return seqs
 
+    def _get_rows(self, direction):
+        """Returns the four sequences for the specified move packed as 16 bit rows for the lookup tables.
+
+        Each tile is packed as a 4 bit exponent, with the first tile of the sequence in the lowest nibble. Left and
+        right moves use the rows of the grid, and up and down moves its columns.
+
+        @param direction: left, right, up or down to specify the move direction
+        @return: the list of four rows, or None if the grid is not 4x4 or holds a tile too large for the tables
+        """
+        if self.grid_size != 4:
+            return None
+        g = self.grid
+        try:
+            if direction == "left" or direction == "right":
+                return [_exponents[g[0][j]] | (_exponents[g[1][j]] << 4) | (_exponents[g[2][j]] << 8) |
+                        (_exponents[g[3][j]] << 12) for j in range(4)]
+            return [_exponents[g[i][0]] | (_exponents[g[i][1]] << 4) | (_exponents[g[i][2]] << 8) |
+                    (_exponents[g[i][3]] << 12) for i in range(4)]
+        except KeyError:
+            return None
+
     def get_score(self):
         """:returns the current score"""
         return self.score
@@ -74,36 +115,120 @@ class Game(object):
         if not self.playing:
             raise utils.GameOverException("Attempting to make a move on a finished game")
 
-        move_score = 0
-        valid = False
-        seqs = self._get_sequences(direction)
+        # Whether the move is valid is found before the grid is changed, so the position before it is only kept when
+        # it is needed
+        rows = self._get_rows(direction)
+        if rows is not None:
+            changed = _row_tables[direction][2]
+            valid = changed[rows[0]] or changed[rows[1]] or changed[rows[2]] or changed[rows[3]]
+        else:
+            move_score = 0
+            valid = False
+            seqs = self._get_sequences(direction)
 
-        for i in range(self.grid_size):
-            s, v = seqs[i].make_move()
-            move_score += s
-            valid = (valid or v)
+            for i in range(self.grid_size):
+                s, v = seqs[i].make_move()
+                move_score += s
+                valid = (valid or v)
 
         if valid:
-            self._set_sequences(seqs, direction)
+            if self.recorder is not None:
+                old_grid = [list(column) for column in self.grid]
+            if self.undo_limit:
+                self.undo_stack.append(self.fork())
+                del self.redo_stack[:]
+
+            if rows is not None:
+                move_score = self._set_rows(rows, direction)[0]
+            else:
+                self._set_sequences(seqs, direction)
             self.score += move_score
-            self._spawn_tile()
+            x, y, value = self._spawn_tile()
 
         if not self.test_available_moves():
             self.game_over()
 
+        if valid and self.recorder is not None:
+            self.recorder.record_grid(old_grid, move_indices[direction], 4 * y + x, value // 2, self.score,
+                                      not self.playing)
+
     def new_game(self):
         """Creates a new game."""
         self.score = 0
         self.playing = True
         self.grid = [[i*j*0 for i in range(self.grid_size)] for j in range(self.grid_size)]
+        self.undo_stack.clear()
+        del self.redo_stack[:]
         self._spawn_tile()
         self._spawn_tile()
 
+    def fork(self, include_rng=False):
+        """Returns a snapshot of the position, from which the game can be restored later.
+
+        The snapshot is an immutable tuple holding the tiles packed into a single integer, with 8 bits for the
+        exponent of each tile, along with the score and whether the game is still playing. It can be shared freely,
+        for example between the branches of a search.
+
+        @param include_rng: whether to save the state of the random number generator too, so that restoring the
+        snapshot also repeats the tiles spawned after it
+        @return: the snapshot
+        """
+        board = 0
+        shift = 0
+        grid = self.grid
+        for y in range(self.grid_size):
+            for x in range(self.grid_size):
+                if grid[x][y]:
+                    board |= (grid[x][y].bit_length() - 1) << shift
+                shift += 8
+        if include_rng:
+            return board, self.score, self.playing, self.rng.getstate()
+        return board, self.score, self.playing, None
+
+    def restore(self, snapshot):
+        """Puts the game back into the position of a snapshot. The undo and redo history is left as it is.
+
+        @param snapshot: a snapshot from fork of a game with the same grid size
+        """
+        board, self.score, self.playing, rng_state = snapshot
+        grid = [[0] * self.grid_size for i in range(self.grid_size)]
+        for y in range(self.grid_size):
+            for x in range(self.grid_size):
+                exponent = board & 0xFF
+                if exponent:
+                    grid[x][y] = 1 << exponent
+                board >>= 8
+        self.grid = grid
+        if rng_state is not None:
+            self.rng.setstate(rng_state)
+
+    def undo(self):
+        """Takes back the last move, if there is one to take back.
+
+        @return: whether a move was taken back
+        """
+        if not self.undo_stack:
+            return False
+        self.redo_stack.append(self.fork())
+        self.restore(self.undo_stack.pop())
+        return True
+
+    def redo(self):
+        """Makes the last move taken back again, with the same tile spawned, if no other move has been made since.
+
+        @return: whether a move was made again
+        """
+        if not self.redo_stack:
+            return False
+        self.undo_stack.append(self.fork())
+        self.restore(self.redo_stack.pop())
+        return True
+
     def _set_sequences(self, seqs, direction):
         """Sets the grid to the pattern specified by seqs.
 
         Arguments:
-        @param seqs: the list of four sequences containing the current game state
+        @param seqs: the list of sequences containing the current game state
         @param direction: left, right, up or down to specify the move direction
         """
 
@@ -134,6 +259,30 @@ class Game(object):
                     self._set_tile(x, self.grid_size - y - 1, seqs[x].get_value(y))
         return seqs
 
+    def _set_rows(self, rows, direction):
+        """Carries out a move on the rows from _get_rows through the lookup tables and sets the grid to the result.
+
+        @param rows: the list of four rows from _get_rows
+        @param direction: left, right, up or down to specify the move direction
+        @return: the score gained by the move and whether or not the move is valid
+        """
+        table, scores, changed = _row_tables[direction]
+        move_score = 0
+        valid = False
+        for k in range(4):
+            if not changed[rows[k]]:
+                continue
+            valid = True
+            move_score += scores[rows[k]]
+            row = table[rows[k]]
+            if direction == "left" or direction == "right":
+                for i in range(4):
+                    self.grid[i][k] = _values[(row >> (4 * i)) & 0xF]
+            else:
+                for j in range(4):
+                    self.grid[k][j] = _values[(row >> (4 * j)) & 0xF]
+        return move_score, valid
+
     def _set_tile(self, x, y, value):
         """Sets the specified square to the value."""
 
@@ -145,24 +294,30 @@ class Game(object):
         self.grid[x][y] = value
 
     def _spawn_tile(self):
-        """Randomly spawns a new tile in an available space."""
+        """Randomly spawns a new tile in an available space.
+
+        The space is chosen from a list of the free spaces, ordered as the nibbles of a bitboard.BitboardGame, so
+        that a 4x4 game given a generator seeded alike spawns the same tiles as a BitboardGame. The list is built
+        afresh in one pass over the grid rather than kept up to date between spawns, since a move can change every
+        space and the grid is also set directly, as by restore and trajectory.set_position.
+
+        @return: the coordinates x and y of the new tile and its value
+        """
 
         if not self.playing:
             raise utils.GameOverException("Attempting to make a spawn a tile for a finished game")
 
-        x = -1
-        y = -1
-
-        while True:
-            x = random.randint(0, 3)
-            y = random.randint(0, 3)
-            if self._is_available(x, y):
-                break
+        grid = self.grid
+        size = self.grid_size
+        available = [(x, y) for y in range(size) for x in range(size) if grid[x][y] == 0]
+        x, y = available[int(self.rng.random() * len(available))]
 
-        if random.random() < 0.1:
-            self._set_tile(x, y, 4)
+        if self.rng.random() < 0.1:
+            value = 4
         else:
-            self._set_tile(x, y, 2)
+            value = 2
+        self._set_tile(x, y, value)
+        return x, y, value
 
     def test_available_moves(self):
         """Tests whether or not there are available moves."""
@@ -182,6 +337,11 @@ class Game(object):
         if not self.playing:
             raise utils.GameOverException("Attempting to make a test a move for a finished game")
 
+        rows = self._get_rows(direction)
+        if rows is not None:
+            changed = _row_tables[direction][2]
+            return changed[rows[0]] or changed[rows[1]] or changed[rows[2]] or changed[rows[3]]
+
         valid = False
         seqs = self._get_sequences(direction)
         for i in range(self.grid_size):
@@ -215,23 +375,37 @@ class Sequence:
     def make_move(self):
         """Applies the move taking algorithm to the sequence, returning the score and whether the move is valid"""
 
-        self._shift_left()
-        for i in range(self.grid_size - 1):
-            if self.seq_list[i] == self.seq_list[i + 1]:
-                self.seq_list[i] *= 2
-                self.seq_list[i + 1] = 0
-                self.score += self.seq_list[i]
-                self._shift_left()
+        # Merge each pair of matching tiles in one pass over the tiles, taking time linear in the length of the row
+        tiles = [value for value in self.seq_list if value != 0]
+        merged = []
+        i = 0
+        while i < len(tiles):
+            if i + 1 < len(tiles) and tiles[i] == tiles[i + 1]:
+                merged.append(2 * tiles[i])
+                self.score += 2 * tiles[i]
+                i += 2
+            else:
+                merged.append(tiles[i])
+                i += 1
+        self.seq_list = merged + [0] * (self.grid_size - len(merged))
 
         valid = not (self.seq_list == self.seq_orig)
 
         return self.score, valid
 
-    def _shift_left(self):
-        """Moves all elements to the left, filling up blanks"""
-        while 0 in self.seq_list:
-            self.seq_list.remove(0)
-        while len(self.seq_list) < self.grid_size:
-            self.seq_list.append(0)
-
 moves = {0: "left", 1: "right", 2: "up", 3: "down"}
+min_grid_size = 3
+max_grid_size = 8
+# The index in moves of each direction
+move_indices = dict((direction, i) for i, direction in moves.items())
+
+# Tiles of 32768 and above are left to Sequence, since merging them would overflow the 4 bit exponents of the tables
+_exponents = dict((2 ** i, i) for i in range(1, 15))
+_exponents[0] = 0
+_values = [0] + [2 ** i for i in range(1, 16)]
+
+_tables = tables.load_tables()
+_left = (_tables["left"].tolist(), _tables["score_left"].tolist(), _tables["changed_left"].tolist())
+_right = (_tables["right"].tolist(), _tables["score_right"].tolist(), _tables["changed_right"].tolist())
+# For each direction: the table of moved rows, the table of scores and the table of whether the row changes
+_row_tables = {"left": _left, "right": _right, "up": _left, "down": _right}
@@ -1,34 +1,48 @@
 from gi.repository import Gtk
 from gi.repository import Gdk
 import os
-import simplecrypt as sc
-from utils import get_password, is_power
+import random
 
+import board_painter as bp
 import game
 import game_display as gd
+import save_game
 
 
 class GameInteractive(gd.GameDisplay):
     """A game of 2048 with a display and interactive moving."""
 
-    def __init__(self):
-        """Initialise the game and the display."""
-        super(GameInteractive, self).__init__()
-        if os.path.isfile(save_file):
+    def __init__(self, grid_size=4, slot=0, undo_limit=1000):
+        """Initialise the game and the display.
+
+        Moves can be taken back with u or Ctrl+Z, and made again with r or Ctrl+Y.
+
+        @param grid_size: the number of tiles along each side of the grid
+        @param slot: the save slot to load the game from and save it to
+        @param undo_limit: the most moves that can be taken back
+        """
+        super(GameInteractive, self).__init__(grid_size, undo_limit)
+        # The game has its own generator, so that its state can be saved and restored with the game
+        self.rng = random.Random()
+        self.history = []
+        self.undone = []
+        self.save_path = save_game.get_slot_path(slot)
+        if os.path.isfile(self.save_path):
             self._load_save()
 
     def _create_display(self):
         """Sets up the window ready for display."""
         self.win = Gtk.Window()
         self.win.set_title("2048 Interactive")
-        self.win.set_default_size(gd.grid_right + gd.right_border, gd.grid_bottom + gd.bottom_border + button_height)
+        self.win.set_default_size(self.grid_right + bp.right_border,
+                                  self.grid_bottom + bp.bottom_border + button_height)
         self.win.connect("key-press-event", self._key_pressed)
 
         grid = Gtk.Grid()
         self.win.add(grid)
 
         da = Gtk.DrawingArea()
-        da.set_size_request(gd.grid_right + gd.right_border, gd.grid_bottom + gd.bottom_border)
+        da.set_size_request(self.grid_right + bp.right_border, self.grid_bottom + bp.bottom_border)
         da.connect("draw", self.update_display)
         grid.attach(da, 0, 0, 2, 1)
 
@@ -49,36 +63,90 @@ class GameInteractive(gd.GameDisplay):
         self.win.show_all()
 
     def _load_save(self):
-        """Loads the saved game file."""
+        """Loads the saved game file, deleting it once it is loaded.
+
+        A save that cannot be parsed or fails its signature is deleted. A good save for a grid of another size is kept
+        for a game of that size, and a new game is started instead.
+        """
         try:
-            load = open(save_file, 'r')
-            cipher_text = load.read()
-            load_string = sc.decrypt(get_password(), cipher_text)
-            load_values = load_string.splitlines()
-            if len(load_values) != self.grid_size*self.grid_size + 1:
-                raise ValueError
-            self.score = int(load_values[0])
-            for i in range(self.grid_size):
-                for j in range(self.grid_size):
-                    self.grid[i][j] = int(load_values[i*self.grid_size + j + 1])
-                    if not is_power(self.grid[i][j], 2) and self.grid[i][j] != 0:
-                        raise ValueError
-        except sc.DecryptionException:
-            print("Save file could not be read. Starting new game")
-            self.new_game()
-        except ValueError:
-            print("Save file format corrupted. Starting new game")
+            state = save_game.read_save(self.save_path, save_game.get_key())
+        except IOError as e:
+            print("Save file could not be read (%s). Starting new game" % e)
+            state = None
+        except save_game.SaveFormatError as e:
+            print("Save file is not valid (%s), so it is deleted. Starting new game" % e)
+            os.remove(self.save_path)
+            state = None
+
+        if state is not None and state["grid_size"] != self.grid_size:
+            print("Save file is for a grid of size %i, so it is kept. Starting new game" % state["grid_size"])
+            state = None
+
+        if state is None:
             self.new_game()
+        else:
+            self.grid = state["grid"]
+            self.score = state["score"]
+            self.history = state["history"]
+            if state["rng_state"] is not None:
+                self.rng.setstate(state["rng_state"])
+            self.playing = True
+            if not self.test_available_moves():
+                self.game_over()
+            os.remove(self.save_path)
+        self.win.queue_draw()
+
+    def make_move(self, direction):
+        """
+        Carries out a move in the specified direction, adding it to the history if it is valid.
+
+        @param direction: which direction to move in
+        """
+        if self.playing and self.test_move(direction):
+            self.history.append(game.move_indices[direction])
+            self.undone = []
+        super(GameInteractive, self).make_move(direction)
+
+    def undo(self):
+        """Takes back the last move, if there is one to take back, and queues a display update.
+
+        @return: whether a move was taken back
+        """
+        if not super(GameInteractive, self).undo():
+            return False
+        self.undone.append(self.history.pop())
+        self.win.queue_draw()
+        return True
 
-        os.remove(save_file)
+    def redo(self):
+        """Makes the last move taken back again, if no other move has been made since, and queues a display update.
+
+        @return: whether a move was made again
+        """
+        if not super(GameInteractive, self).redo():
+            return False
+        self.history.append(self.undone.pop())
         self.win.queue_draw()
+        return True
+
+    def new_game(self):
+        """Creates a new game."""
+        self.history = []
+        self.undone = []
+        super(GameInteractive, self).new_game()
 
     def _key_pressed(self, widget, event):
         """Deals with keys pressed to make moves"""
         del widget
         key_name = Gdk.keyval_name(event.keyval).lower()
+        control = event.state & Gdk.ModifierType.CONTROL_MASK
         if key_name in game.moves.values():
-            self.make_move(key_name)
+            if self.playing:
+                self.make_move(key_name)
+        elif key_name == "u" or (control and key_name == "z"):
+            self.undo()
+        elif key_name == "r" or (control and key_name == "y"):
+            self.redo()
         self.win.queue_draw()
         return True
 
@@ -91,20 +159,8 @@ class GameInteractive(gd.GameDisplay):
     def _save_quit(self, button):
         """Writes the game data to a file and exits."""
         del button
-
-        save = open(save_file, 'w')
-        save_string = ""
-        save_string += str(self.score) + '\n'
-        for i in range(self.grid_size):
-            for j in range(self.grid_size):
-                save_string += str(self.grid[i][j]) + '\n'
-
-        cipher_text = sc.encrypt(get_password(), save_string)
-        save.write(cipher_text)
-        save.close()
-
+        save_game.write_save(self.save_path, self, self.history, save_game.get_key())
         Gtk.main_quit()
 
 
 button_height = 30
-save_file = "save_game"
@@ -1,6 +1,18 @@
+import batch_game
+import checkpoint
 import controller
-from multiprocessing import Pool
+import copy
+import fitness_cache
+import game
+import json
+from multiprocessing import Pool, RawArray
+import numpy
+import os
+import profiling
 import random
+import sys
+import tables
+import time
 
 
 def breed(parent1, parent2, sigma):
@@ -17,16 +29,197 @@ def breed(parent1, parent2, sigma):
     """
     if parent1.net.params.shape != parent2.net.params.shape:
         raise ValueError("Can't breed nets: they are not the same shape")
-    child = controller.Controller(1, [1])
+    child = copy.copy(parent1)
     child.net = parent1.net.copy()
-    for i in range(child.net.params.size):
-        mu = (parent1.net.params[i] + parent2.net.params[i]) / 2
-        child.net.params[i] = random.gauss(mu, sigma)
+    child.net.params[:] = numpy.random.normal((parent1.net.params + parent2.net.params) / 2, sigma)
     child.net.sortModules()
     return child
 
 
-def run_breeding(pop, sel, grid_size, hidden_list, drift, sigma, gen, num, proc):
+def breed_population(parents, size, sigma):
+    """
+    Breeds a generation of children from the parameters of the selected controllers.
+    Each child has two different parents chosen at random, and each of its parameters is drawn from a normal
+    distribution about the average of the parental values, as in breed.
+
+    @param parents: the parameters of the parents, one per row
+    @param size: the number of children
+    @param sigma: standard deviation of the normal distribution
+    @return: the parameters of the children, one per row
+    """
+    if len(parents) < 2:
+        raise ValueError("Can't breed nets: at least two parents are needed")
+    first = numpy.random.randint(0, len(parents), size)
+    # Adding an offset of 1 to len(parents) - 1 places always picks a different second parent
+    second = (first + numpy.random.randint(1, len(parents), size)) % len(parents)
+    children = parents[first]
+    children += parents[second]
+    children *= 0.5
+    children += numpy.random.normal(0, sigma, children.shape)
+    return children
+
+
+def mutate_population(params, drift):
+    """
+    Mutates a generation by randomly altering each parameter of each net, as in Controller.mutate.
+
+    @param params: the parameters of the nets, one per row, which are changed in place
+    @param drift: scales the size of mutation to apply
+    """
+    noise = numpy.random.random_sample(params.shape)
+    noise -= 0.5
+    noise *= drift
+    params += noise
+
+
+def _init_worker(num, controller_class, grid_size, hidden_list, shared_params, profile=False):
+    """Sets up a worker process of the evaluation pool, building the state it keeps for the whole run.
+
+    Each worker builds one controller of the population's shape, and evaluates each member by copying its
+    parameters into that controller from the population matrix held in shared memory.
+
+    @param num: number of runs to average over when calculating fitness
+    @param controller_class: the type of controller in the population
+    @param grid_size: dimension of the 2048 grid
+    @param hidden_list: shape of the hidden layers in the net
+    @param shared_params: the shared array holding the parameters of each member of the population, one per row
+    @param profile: whether to time the moves, spawns and net activations of the games the worker plays
+    """
+    controller.set_num(num)
+    tables.load_tables()
+    _worker["controller"] = controller_class(grid_size, hidden_list)
+    size = _worker["controller"].net.params.size
+    _worker["params"] = numpy.frombuffer(shared_params, dtype=numpy.float64).reshape(-1, size)
+
+    # The worker's own copies of the game classes are timed, so the games played in the main process are not
+    _worker["profiler"] = profiler = profiling.Profiler(profile)
+    if profile:
+        profiler.instrument(game.Game, "make_move", "make_move")
+        profiler.instrument(game.Game, "_spawn_tile", "spawn")
+        profiler.instrument(batch_game.BatchGame, "make_move", "make_move")
+        profiler.instrument(batch_game.BatchGame, "_spawn_tiles", "spawn")
+        profiler.instrument(_worker["controller"].net, "activate", "activate")
+
+
+def _evaluate(task):
+    """Plays games for one member of the population in a worker process.
+
+    @param task: the index of the member in the population, the number of games to play, and the seeds of the games
+    or None
+    @return: the index, a list of the score of each game, and a report of the time spent in the task from
+    profiling.Profiler.get_report, with the process id of the worker under pid, or None if the worker is not
+    profiling
+    """
+    index, games, seeds = task
+    cont = _worker["controller"]
+    cont.net.params[:] = _worker["params"][index]
+    profiler = _worker["profiler"]
+    if not profiler.enabled:
+        return index, controller.get_scores(cont, games, seeds), None
+    with profiler.time("task"):
+        scores = controller.get_scores(cont, games, seeds)
+    report = profiler.get_report()
+    report["pid"] = os.getpid()
+    profiler.reset()
+    return index, scores, report
+
+
+def _get_seeds(config, games):
+    """Returns the seeds for a set of games to be played by every member of the population.
+
+    @param config: the arguments of run_breeding
+    @param games: the number of games
+    @return: a list of seeds, or None if the members play unseeded games
+    """
+    if config.get("seeds") is not None:
+        return config["seeds"]
+    if config.get("common_seeds"):
+        return [random.getrandbits(32) for j in range(games)]
+    return None
+
+
+def _race(pool, config, chunksize, worker_profilers):
+    """
+    Evaluates the population in rounds of games, stopping early for members whose place in the selection is settled.
+
+    Every member plays a round of race_round games, or num if that is fewer, and a confidence interval for its mean
+    score is worked out from the games it has played so far. A member stops playing once its interval lies wholly
+    below the lower bounds of sel other members, so it cannot be selected, or wholly above the upper bounds of all but
+    sel - 1 others, so it will be. The remaining members play further rounds, up to race_limit times num games each,
+    until the selection is settled or the num games per member that evaluating everyone in full would have cost are
+    used up.
+
+    @param pool: the pool of workers, with the parameters of the population in shared memory
+    @param config: the arguments of run_breeding
+    @param chunksize: the number of members sent to a worker at a time
+    @param worker_profilers: a dictionary of a profiling.Profiler for each worker, by process id, to add the time
+    reported by the workers to
+    @return: a list of the fitness of each member, the mean of the games it played, and the total number of games
+    """
+    pop = config["pop"]
+    sel = config["sel"]
+    num = config["num"]
+    scores = [[] for j in range(pop)]
+    budget = pop * num
+    games = min(race_round, num)
+    played = 0
+    contenders = list(range(pop))
+
+    # The first round is always played, so that every member has a score even when the budget is smaller than a round
+    while contenders and (played == 0 or played + len(contenders) * games <= budget):
+        seeds = _get_seeds(config, games)
+        tasks = [(j, games, seeds) for j in contenders]
+        round_chunksize = max(1, min(chunksize, len(tasks) // (4 * config["proc"])))
+        for index, game_scores, report in pool.imap_unordered(_evaluate, tasks, round_chunksize):
+            scores[index].extend(game_scores)
+            if report is not None:
+                _add_worker_report(worker_profilers, report)
+        played += len(contenders) * games
+
+        if sel >= pop:
+            break
+        bounds = [_confidence_interval(s) for s in scores]
+        lower_cutoff = sorted((b[0] for b in bounds), reverse=True)[sel - 1]
+        upper_cutoff = sorted((b[1] for b in bounds), reverse=True)[sel]
+        # The selection is settled once sel members are sure to be in it, or once only sel might still be
+        selected = sum(1 for b in bounds if b[0] > upper_cutoff)
+        rejected = sum(1 for b in bounds if b[1] < lower_cutoff)
+        if selected >= sel or pop - rejected <= sel:
+            break
+        contenders = [j for j in contenders if bounds[j][1] >= lower_cutoff and bounds[j][0] <= upper_cutoff and
+                      len(scores[j]) < race_limit * num]
+
+    return [float(sum(s)) / len(s) for s in scores], played
+
+
+def _add_worker_report(worker_profilers, report):
+    """Adds the time reported by a worker for a task to the profiler kept for that worker.
+
+    @param worker_profilers: a dictionary of a profiling.Profiler for each worker, by process id
+    @param report: the report returned by _evaluate
+    """
+    if report["pid"] not in worker_profilers:
+        worker_profilers[report["pid"]] = profiling.Profiler()
+    worker_profilers[report["pid"]].merge(report)
+
+
+def _confidence_interval(scores):
+    """Returns the lower and upper ends of a confidence interval for the mean of a list of game scores.
+
+    @param scores: the scores. With fewer than two there is no estimate of their spread, so the interval is infinite.
+    """
+    if len(scores) < 2:
+        return -float("inf"), float("inf")
+    mean = float(sum(scores)) / len(scores)
+    variance = sum((s - mean) ** 2 for s in scores) / (len(scores) - 1)
+    half_width = race_z * (variance / len(scores)) ** 0.5
+    return mean - half_width, mean + half_width
+
+
+def run_breeding(pop, sel, grid_size, hidden_list, drift, sigma, gen, num, proc, chunksize=None,
+                 controller_class=controller.Controller, checkpoint_file=None, checkpoint_every=1,
+                 common_seeds=False, racing=False, cache_size=0, cache_file=None, migration=None, log_file=None,
+                 profile=False, elite=0, island=None):
     """
     Runs a complete simulation, breeding the nets.
 
@@ -38,74 +231,241 @@ def run_breeding(pop, sel, grid_size, hidden_list, drift, sigma, gen, num, proc)
     @param sigma: determines how much sexual variation in each child
     @param gen: number of generation to run
     @param num: number of runs to average over when calculating fitness
-    @param proc: the number of different threads to use when evaluating fitnesses
+    @param proc: the number of worker processes to use when evaluating fitnesses
+    @param chunksize: the number of controllers sent to a worker at a time, by default enough for each worker to get
+    about four chunks per generation
+    @param controller_class: the type of controller to breed, which must be defined in the controller module
+    @param checkpoint_file: a file to save the state of the run to, so that it can be continued by resume_breeding
+    @param checkpoint_every: the number of generations between checkpoints
+    @param common_seeds: whether every controller in a generation plays the same num seeded games, so that they are
+    ranked on the same luck and fewer games are needed to tell them apart
+    @param racing: whether to evaluate the population in rounds, stopping early for controllers that are clearly in
+    or out of the selection and spending the games saved on those near the cutoff
+    @param cache_size: the most fitnesses to keep in a cache, so that a controller is not evaluated again on the same
+    games, or 0 for no cache. The cache needs common_seeds, and then every generation plays the same num games, drawn
+    at the start of the run, so that the elite carried over from one generation to the next are not evaluated again.
+    The cache is not used when racing.
+    @param cache_file: a file to load the cache from at the start and save it to at the end, so that it carries over
+    between runs
+    @param migration: an island.Migration for exchanging the best controllers with other populations, or None to
+    evolve this population alone
+    @param log_file: a file to append the summary of each generation to as a line of JSON, or None to print the
+    summaries. The summary of the last generation also holds the parameters of the best controller.
+    @param profile: whether to time each stage of a generation, and the moves, spawns and net activations in the
+    worker processes, adding the times to the summaries with those of each worker under its process id
+    @param elite: the number of the best controllers of each generation carried into the next unchanged, at most sel
+    @param island: the number of the island this population lives on, added to each summary to tell the islands of a
+    run apart, or None
+    @return: the best fitness found and the parameters of the controller with it
     """
+    if elite > sel:
+        raise ValueError("The elite must be no more than the %i controllers selected" % sel)
+    if cache_size and not racing and not common_seeds:
+        raise ValueError("The fitness cache needs common_seeds, as the fitnesses of unseeded games are not repeatable")
+
     # Generate the initial population
-    population = []
-    for i in range(pop):
-        population.append(controller.Controller(grid_size, hidden_list))
+    population = numpy.array([controller_class(grid_size, hidden_list).net.params for i in range(pop)],
+                             dtype=numpy.float64)
 
-    best_fitness = 0
-    best_params = []
+    config = {"pop": pop, "sel": sel, "grid_size": grid_size, "hidden_list": list(hidden_list), "drift": drift,
+              "sigma": sigma, "gen": gen, "num": num, "proc": proc, "chunksize": chunksize,
+              "controller_class": controller_class.__name__, "checkpoint_file": checkpoint_file,
+              "checkpoint_every": checkpoint_every, "common_seeds": common_seeds,
+              "racing": racing, "cache_size": cache_size, "cache_file": cache_file, "log_file": log_file,
+              "profile": profile, "elite": elite, "seeds": None, "island": island}
+    if cache_size and not racing:
+        # The same games are played in every generation, so that cached fitnesses can be used again
+        config["seeds"] = [random.getrandbits(32) for j in range(num)]
+    return _run_generations(config, population, 0, 0, [], migration)
+
+
+def resume_breeding(path, proc=None, migration=None):
+    """
+    Continues a simulation from the last checkpoint saved by run_breeding.
+
+    @param path: the checkpoint file
+    @param proc: the number of worker processes to use, by default the number used by the original run
+    @param migration: an island.Migration for exchanging the best controllers with other populations, which must be
+    given again to resume a run that was one of a ring of islands, or None to evolve this population alone
+    @return: the best fitness found and the parameters of the controller with it
+    """
+    state = checkpoint.read_checkpoint(path)
+    config = state["config"]
+    if proc is not None:
+        config["proc"] = proc
+    random.setstate(state["random_state"])
+    numpy.random.set_state(state["numpy_state"])
+
+    return _run_generations(config, numpy.array(state["population"], dtype=numpy.float64), int(state["generation"]),
+                            state["best_fitness"].item(), state["best_params"], migration, True)
 
-    # Loop over the number of generations
-    controller.set_num(num)
-    for i in range(gen):
-        print "BEGINNING GENERATION " + str(i)
 
-        pop_best_fitness = 0
-        pop_best_params = []
+def _run_generations(config, population, first, best_fitness, best_params, migration=None, resumed=False):
+    """
+    Runs the generations of a simulation, from the given generation up to the last.
+
+    @param config: the arguments of run_breeding
+    @param population: the parameters of the controllers of the first generation to run, one per row
+    @param first: the number of the first generation to run
+    @param best_fitness: the best fitness found in earlier generations
+    @param best_params: the parameters of the controller with the best fitness
+    @param migration: an island.Migration for exchanging controllers with other populations, or None
+    @param resumed: whether the run is being resumed from a checkpoint, which is noted in the log before the first
+    generation
+    @return: the best fitness found and the parameters of the controller with it
+    """
+    pop = config["pop"]
+    sel = config["sel"]
+    sigma = config["sigma"]
+    drift = config["drift"]
+    num = config["num"]
+    proc = config["proc"]
+    elite = config.get("elite", 0)
+    controller_class = getattr(controller, config["controller_class"])
+
+    chunksize = config["chunksize"]
+    if chunksize is None:
+        chunksize = max(1, pop // (4 * proc))
+
+    sizes = controller_class(config["grid_size"], config["hidden_list"]).sizes
+
+    # The parameters of the population are passed to the workers through shared memory, so that each task only
+    # needs to carry the index of the member to evaluate
+    size = population.shape[1]
+    shared_params = RawArray("d", pop * size)
+    params = numpy.frombuffer(shared_params, dtype=numpy.float64).reshape(pop, size)
+
+    cache = None
+    if config.get("cache_size") and config.get("seeds") is not None:
+        cache = fitness_cache.FitnessCache(config["cache_size"], config.get("cache_file"))
+
+    checkpointer = None
+    if config["checkpoint_file"] is not None:
+        checkpointer = checkpoint.Checkpointer(config["checkpoint_file"])
+
+    log = sys.stdout
+    if config.get("log_file") is not None:
+        log = open(config["log_file"], "a")
+    if resumed:
+        record = {"event": "resume", "generation": first}
+        if config.get("island") is not None:
+            record["island"] = config["island"]
+        log.write(json.dumps(record, sort_keys=True) + "\n")
+        log.flush()
 
-        # Get fitness for each controller
-        fitnesses = {}
-        for j in range(pop/proc + 1):
-            if proc*(j + 1) <= pop:
-                p = proc
+    # The pool lasts for the whole run, so workers only build their state once and results are collected as soon as
+    # each chunk finishes rather than waiting for the slowest of a batch
+    controller.set_num(num)
+    profile = config.get("profile", False)
+    pool = Pool(proc, initializer=_init_worker,
+                initargs=(num, controller_class, config["grid_size"], config["hidden_list"], shared_params, profile))
+    try:
+        # Loop over the number of generations
+        for i in range(first, config["gen"]):
+            start = time.time()
+            profiler = profiling.Profiler(profile)
+            worker_profilers = {}
+            summary = {"generation": i}
+            if config.get("island") is not None:
+                summary["island"] = config["island"]
+
+            # Get fitness for each controller
+            with profiler.time("share"):
+                params[:] = population
+            if config.get("racing"):
+                with profiler.time("evaluate"):
+                    fitnesses, played = _race(pool, config, chunksize, worker_profilers)
+                summary["games"] = played
             else:
-                p = pop - j*proc
-            if p == 0:
-                break
-
-            pool = Pool(p)
-            print "Calculating fitness for member " + str(j*proc) + " to " + str(j*proc + p - 1)
-            fits = pool.map(controller.get_fitness, population[j*proc:j*proc + p])
-            for k in range(len(fits)):
-                fitnesses[fits[k]] = population[j*proc + k]
-
-            pool.close()
-            pool.terminate()
-            pool.join()
-
-        # Select the best controllers
-        breeding_population = []
-        for key in sorted(fitnesses, reverse=True):
-            if len(breeding_population) >= sel:
-                break
-            breeding_population.append(fitnesses[key])
-            print "Adding controller with fitness " + str(key) + " to breeding population"
-            if key > pop_best_fitness:
-                pop_best_fitness = key
-                pop_best_params = fitnesses[key].net.params
-                print "New best fitness: " + str(best_fitness)
-            if key > best_fitness:
-                best_fitness = key
-                best_params = fitnesses[key].net.params
-                print "New best fitness: " + str(best_fitness)
-
-        # Create the children by randomly selecting breeding pairs
-        population = []
-        while len(population) < pop:
-            p1 = random.randint(0, len(breeding_population) - 1)
-            p2 = p1
-            while p2 == p1:
-                p2 = random.randint(0, len(breeding_population) - 1)
-            print "Breeding child from parent " + str(p1) + " and " + str(p2)
-            child = breed(breeding_population[p1], breeding_population[p2], sigma)
-            child.mutate(drift)
-            population.append(child)
-
-        print "Best population fitness: " + str(pop_best_fitness)
-        print "Best population parameters: " + str(pop_best_params)
-        print "Best fitness: " + str(best_fitness)
-        print "Best parameters: " + str(best_params)
-        print "END GENERATION " + str(i)
+                fitnesses = [0] * pop
+                seeds = _get_seeds(config, num)
+                tasks = []
+                keys = [None] * pop
+                with profiler.time("cache"):
+                    for j in range(pop):
+                        if cache is not None:
+                            keys[j] = fitness_cache.make_key(params[j], sizes, seeds, num)
+                            fitnesses[j] = cache.get(keys[j])
+                            if fitnesses[j] is not None:
+                                continue
+                        tasks.append((j, num, seeds))
+                with profiler.time("evaluate"):
+                    for index, game_scores, report in pool.imap_unordered(_evaluate, tasks, chunksize):
+                        fitnesses[index] = float(sum(game_scores)) / num
+                        if cache is not None:
+                            cache.put(keys[index], fitnesses[index])
+                        if report is not None:
+                            _add_worker_report(worker_profilers, report)
+                summary["games"] = len(tasks) * num
+                if cache is not None:
+                    summary["cache_hit_rate"] = cache.get_hit_rate()
+
+            # Select the best controllers
+            with profiler.time("select"):
+                order = sorted(range(pop), key=lambda k: fitnesses[k], reverse=True)
+                breeders = population[order[:sel]]
+                if fitnesses[order[0]] > best_fitness:
+                    best_fitness = fitnesses[order[0]]
+                    best_params = breeders[0].copy()
+
+            # Send the best controllers to the next island, and let the ones received replace the worst of the breeders
+            if migration is not None:
+                with profiler.time("migrate"):
+                    migrants = migration.exchange(i, list(breeders))
+                    migrants = migrants[:len(breeders)]
+                    for k in range(len(migrants)):
+                        breeders[-1 - k] = migrants[k]
+                summary["migrants"] = len(migrants)
+
+            # Create the children by randomly selecting breeding pairs, and carry the elite over unchanged
+            with profiler.time("breed"):
+                children = breed_population(breeders, pop - elite, sigma)
+            with profiler.time("mutate"):
+                mutate_population(children, drift)
+            population = numpy.concatenate([breeders[:elite], children])
+
+            # Save the children, which are the next generation to run
+            if checkpointer is not None and ((i + 1 - first) % config["checkpoint_every"] == 0 or
+                                             i + 1 == config["gen"]):
+                with profiler.time("checkpoint"):
+                    checkpointer.save({"config": config,
+                                       "generation": i + 1,
+                                       "population": population,
+                                       "fitnesses": numpy.array(fitnesses),
+                                       "best_fitness": best_fitness,
+                                       "best_params": numpy.asarray(best_params),
+                                       "random_state": random.getstate(),
+                                       "numpy_state": numpy.random.get_state()})
+
+            summary.update({"seconds": time.time() - start,
+                            "population_best_fitness": float(fitnesses[order[0]]),
+                            "population_mean_fitness": float(sum(fitnesses)) / pop,
+                            "selection_cutoff": float(fitnesses[order[min(sel, pop) - 1]]),
+                            "best_fitness": float(best_fitness)})
+            if i + 1 == config["gen"]:
+                summary["best_params"] = numpy.asarray(best_params).tolist()
+            if profile:
+                summary["profile"] = profiler.get_report()
+                summary["workers"] = dict((str(pid), worker_profilers[pid].get_report()) for pid in worker_profilers)
+            log.write(json.dumps(summary, sort_keys=True) + "\n")
+            log.flush()
+    finally:
+        pool.close()
+        pool.terminate()
+        pool.join()
+        if checkpointer is not None:
+            checkpointer.close()
+        if cache is not None:
+            cache.save()
+        if log is not sys.stdout:
+            log.close()
+    return best_fitness, numpy.asarray(best_params)
+
+# The number of games each remaining member plays in a round of racing
+race_round = 2
+# The most games a member may play when racing, as a multiple of the number of games it would play without racing
+race_limit = 2
+# The number of standard errors either side of the mean in the confidence intervals used for racing
+race_z = 1.96
+
+_worker = {}
@@ -0,0 +1,281 @@
+from multiprocessing import Process, Queue
+import numpy
+import pickle
+import random
+import select
+import socket
+import struct
+import threading
+import time
+
+import genetic
+
+try:
+    from Queue import Queue as ThreadQueue
+except ImportError:
+    from queue import Queue as ThreadQueue
+
+
+class Migration(object):
+    """Exchanges the best controllers of an island's population with its neighbours every few generations.
+
+    Pass one to genetic.run_breeding to have it send its best controllers on after selection, and replace its worst
+    breeders with the controllers received in return.
+    """
+
+    def __init__(self, transport, every, size):
+        """Sets up the exchange.
+
+        @param transport: the transport to the neighbouring islands, such as a QueueTransport or a SocketTransport
+        @param every: the number of generations between exchanges
+        @param size: the number of controllers to send at each exchange
+        """
+        self.transport = transport
+        self.every = every
+        self.size = size
+
+    def exchange(self, generation, params):
+        """Sends the best controllers and receives migrants, if an exchange is due in this generation.
+
+        @param generation: the number of the generation
+        @param params: the parameters of the selected controllers, best first
+        @return: a list of the parameters of the controllers received, empty if no exchange was due
+        """
+        if (generation + 1) % self.every != 0:
+            return []
+        self.transport.send([numpy.asarray(p, dtype=numpy.float64) for p in params[:self.size]])
+        return self.transport.receive()
+
+
+class QueueTransport(object):
+    """Carries migrants between islands running as processes on one machine, through multiprocessing queues."""
+
+    def __init__(self, inbox, outbox, timeout=None):
+        """Sets up the transport.
+
+        @param inbox: the queue migrants arrive on
+        @param outbox: the queue to send migrants on
+        @param timeout: the most time to wait for migrants in seconds, or None to wait for as long as it takes
+        """
+        self.inbox = inbox
+        self.outbox = outbox
+        self.timeout = timeout
+
+    def send(self, migrants):
+        """Sends a list of migrants to the next island."""
+        self.outbox.put(migrants)
+
+    def receive(self):
+        """Returns the next list of migrants from the previous island."""
+        return self.inbox.get(timeout=self.timeout)
+
+
+class SocketTransport(object):
+    """Carries migrants between islands over TCP, so that islands can run on different machines.
+
+    Each island listens for its previous island on a port, and connects to the port of the next island. Migrants
+    are sent as pickled lists, each preceded by its length. A background thread reads migrants as they arrive, so
+    that islands sending to each other at the same time never block on full socket buffers. Nothing is opened
+    until the transport is first used, so it can be created before the island's process is started.
+
+    An island that stops and is resumed from a checkpoint with genetic.resume_breeding and a new transport on the
+    same ports rejoins the ring: its previous island is accepted again when it reconnects, and a send that finds the
+    next island's connection broken connects again and resends. Migrants sent while an island is down are lost.
+    """
+
+    def __init__(self, port, next_address, host="", timeout=None, connect_timeout=60):
+        """Sets up the transport.
+
+        @param port: the port to listen on
+        @param next_address: the (host, port) address of the next island
+        @param host: the interface to listen on, all of them by default
+        @param timeout: the most time to wait for migrants in seconds, or None to wait for as long as it takes
+        @param connect_timeout: the most time to keep trying to reach the next island in seconds
+        """
+        self.next_address = next_address
+        self.timeout = timeout
+        self.connect_timeout = connect_timeout
+        self.address = (host, port)
+        self.listener = None
+        self.incoming = None
+        self.outgoing = None
+        self.received = None
+
+    def send(self, migrants):
+        """Sends a list of migrants to the next island, connecting to it first if needed."""
+        self._listen()
+        if self.outgoing is not None and select.select([self.outgoing], [], [], 0)[0]:
+            # The next island never sends anything back, so a readable connection is one it has closed
+            self.outgoing.close()
+            self.outgoing = None
+        if self.outgoing is None:
+            self.outgoing = self._connect()
+        message = pickle.dumps(migrants, 2)
+        data = struct.pack("!Q", len(message)) + message
+        try:
+            self.outgoing.sendall(data)
+        except socket.error:
+            # The next island may have been restarted, so connect to it again
+            self.outgoing.close()
+            self.outgoing = self._connect()
+            self.outgoing.sendall(data)
+
+    def receive(self):
+        """Returns the next list of migrants from the previous island."""
+        self._listen()
+        return self.received.get(timeout=self.timeout)
+
+    def close(self):
+        """Closes the connections."""
+        if self.outgoing is not None:
+            self.outgoing.close()
+            self.outgoing = None
+        if self.listener is not None:
+            try:
+                self.listener.shutdown(socket.SHUT_RDWR)
+            except socket.error:
+                pass
+            self.listener.close()
+            self.listener = None
+        if self.incoming is not None:
+            # Shutting the connection down wakes the reading thread, which closes it
+            try:
+                self.incoming.shutdown(socket.SHUT_RDWR)
+            except socket.error:
+                pass
+            self.incoming = None
+
+    def _listen(self):
+        """Starts listening for the previous island and reading its migrants, if not already doing so."""
+        if self.listener is not None:
+            return
+        self.received = ThreadQueue()
+        self.listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.listener.bind(self.address)
+        self.listener.listen(1)
+        reader = threading.Thread(target=self._read_loop, args=(self.listener,))
+        reader.daemon = True
+        reader.start()
+
+    def _connect(self):
+        """Connects to the next island, retrying while it starts up."""
+        deadline = time.time() + self.connect_timeout
+        while True:
+            try:
+                return socket.create_connection(self.next_address)
+            except socket.error:
+                if time.time() > deadline:
+                    raise
+                time.sleep(0.1)
+
+    def _read_loop(self, listener):
+        """Reads migrants from the previous island, accepting it again whenever it reconnects, until closed."""
+        while True:
+            try:
+                connection = listener.accept()[0]
+            except socket.error:
+                return
+            self.incoming = connection
+            try:
+                while True:
+                    header = _read_exactly(connection, 8)
+                    if header is None:
+                        break
+                    message = _read_exactly(connection, struct.unpack("!Q", header)[0])
+                    if message is None:
+                        break
+                    self.received.put(pickle.loads(message))
+            except socket.error:
+                pass
+            connection.close()
+
+
+def _read_exactly(connection, size):
+    """Reads a number of bytes from a socket, returning None if it closes first."""
+    chunks = []
+    while size > 0:
+        chunk = connection.recv(min(size, 1 << 20))
+        if not chunk:
+            return None
+        chunks.append(chunk)
+        size -= len(chunk)
+    return b"".join(chunks)
+
+
+def run_island(transport, every, size, **kwargs):
+    """Runs the population of one island, exchanging migrants through a transport.
+
+    The random number generators are reseeded, so that islands forked from the same process evolve differently.
+
+    @param transport: the transport to the neighbouring islands
+    @param every: the number of generations between exchanges
+    @param size: the number of controllers to send at each exchange
+    @param kwargs: the arguments for genetic.run_breeding
+    @return: the best fitness found on the island and the parameters of the controller with it
+    """
+    random.seed()
+    numpy.random.seed()
+    return genetic.run_breeding(migration=Migration(transport, every, size), **kwargs)
+
+
+def run_islands(islands, every, size, transport="queue", base_port=None, **kwargs):
+    """Runs several populations in parallel on this machine, arranged in a ring that passes migrants along.
+
+    Each island writes its checkpoints, cache and log to its own files, named by appending a dot and the number of the
+    island to the paths given, and marks its summaries with its number.
+
+    @param islands: the number of populations
+    @param every: the number of generations between exchanges
+    @param size: the number of controllers each island sends at each exchange
+    @param transport: queue to pass migrants through multiprocessing queues, or socket to pass them over TCP on
+    localhost
+    @param base_port: the port of the first island when using sockets, with the others on the following ports
+    @param kwargs: the arguments for genetic.run_breeding, used for every island
+    @return: a list of the best fitness found on each island and the parameters of the controller with it
+    """
+    if transport == "queue":
+        queues = [Queue() for i in range(islands)]
+        transports = [QueueTransport(queues[i], queues[(i + 1) % islands]) for i in range(islands)]
+    elif transport == "socket":
+        if base_port is None:
+            raise ValueError("A base port is needed for the socket transport")
+        transports = [SocketTransport(base_port + i, ("localhost", base_port + (i + 1) % islands))
+                      for i in range(islands)]
+    else:
+        raise ValueError("%s is not a recognised transport" % transport)
+
+    results = Queue()
+    processes = []
+    for i in range(islands):
+        island_kwargs = dict(kwargs, island=i)
+        for key in ("checkpoint_file", "cache_file", "log_file"):
+            if island_kwargs.get(key) is not None:
+                island_kwargs[key] = "%s.%i" % (island_kwargs[key], i)
+        processes.append(Process(target=_run_island_process, args=(results, i, transports[i], every, size),
+                                 kwargs=island_kwargs))
+    for p in processes:
+        p.start()
+    # The results are collected before joining, as a process does not exit until what it put on the queue is read
+    best = [None] * islands
+    for i in range(islands):
+        index, result = results.get()
+        best[index] = result
+    for p in processes:
+        p.join()
+    return best
+
+
+def _run_island_process(results, index, transport, every, size, **kwargs):
+    """Runs an island in a process of run_islands, putting its result on a queue.
+
+    @param results: the queue to put the number of the island and its result on, with None for the result if the
+    island failed, so that run_islands does not wait for it forever
+    @param index: the number of the island
+    The other arguments are as for run_island.
+    """
+    result = None
+    try:
+        result = run_island(transport, every, size, **kwargs)
+    finally:
+        results.put((index, result))
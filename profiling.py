@@ -0,0 +1,104 @@
+import time
+
+
+class Profiler(object):
+    """Adds up the time spent in named parts of a program and the number of times each part runs.
+
+    A disabled profiler times nothing, so a run can be timed or not without changing the code that it times.
+    """
+
+    def __init__(self, enabled=True):
+        """Sets up the profiler with no time recorded.
+
+        @param enabled: whether to time anything
+        """
+        self.enabled = enabled
+        self.seconds = {}
+        self.calls = {}
+
+    def time(self, name):
+        """Returns a context manager that adds the time spent in a with block to a name.
+
+        @param name: the name to record the time under
+        """
+        if not self.enabled:
+            return _null_timer
+        return _Timer(self, name)
+
+    def add(self, name, seconds, calls=1):
+        """Adds time to a name.
+
+        @param name: the name to record the time under
+        @param seconds: the time
+        @param calls: the number of runs the time was spent over
+        """
+        self.seconds[name] = self.seconds.get(name, 0.0) + seconds
+        self.calls[name] = self.calls.get(name, 0) + calls
+
+    def wrap(self, function, name):
+        """Returns a function that calls another, adding the time spent in each call to a name.
+
+        @param function: the function to time
+        @param name: the name to record the time under
+        """
+        def timed(*args, **kwargs):
+            start = time.time()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                self.add(name, time.time() - start)
+        return timed
+
+    def instrument(self, owner, attribute, name):
+        """Replaces a function or method of an object, class or module with one that is timed.
+
+        @param owner: the object holding the function
+        @param attribute: the name of the function
+        @param name: the name to record the time under
+        """
+        setattr(owner, attribute, self.wrap(getattr(owner, attribute), name))
+
+    def merge(self, report):
+        """Adds the times from a report of another profiler, such as one in a worker process.
+
+        @param report: the report from get_report
+        """
+        for name, seconds in report["seconds"].items():
+            self.add(name, seconds, report["calls"][name])
+
+    def get_report(self):
+        """Returns the times recorded, as a dictionary of the seconds and the calls under each name."""
+        return {"seconds": dict(self.seconds), "calls": dict(self.calls)}
+
+    def reset(self):
+        """Forgets all of the times recorded."""
+        self.seconds = {}
+        self.calls = {}
+
+
+class _Timer(object):
+    """Times a with block for a Profiler."""
+
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+        self.start = None
+
+    def __enter__(self):
+        self.start = time.time()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.profiler.add(self.name, time.time() - self.start)
+
+
+class _NullTimer(object):
+    """Stands in for a _Timer when profiling is disabled."""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        pass
+
+_null_timer = _NullTimer()
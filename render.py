@@ -0,0 +1,189 @@
+import cairo
+from multiprocessing import Pool
+import numpy
+
+import bitboard
+import board_painter as bp
+import game
+import trajectory
+
+
+class FrameRenderer(object):
+    """Draws positions of a game onto an offscreen surface, without a display.
+
+    The drawing is done by a board_painter.BoardPainter, as in game_display.GameDisplay, so the frames look as the
+    game does on screen. The same surface is drawn over for each frame.
+    """
+
+    def __init__(self, grid_size=4):
+        """Sets up the surface.
+
+        @param grid_size: the number of tiles along each side of the grid
+        """
+        self.painter = bp.BoardPainter(grid_size)
+        self.surface = cairo.ImageSurface(cairo.FORMAT_RGB24, self.painter.width, self.painter.height)
+        self.context = cairo.Context(self.surface)
+
+    def render(self, grid, score):
+        """Draws a position.
+
+        @param grid: the values of the tiles, indexed as grid[x][y]
+        @param score: the score
+        @return: the surface holding the frame, which is drawn over by the next call
+        """
+        self.painter.paint(self.context, grid, score)
+        self.surface.flush()
+        return self.surface
+
+    def write_png(self, grid, score, path):
+        """Draws a position and writes it to a PNG file.
+
+        @param grid: the values of the tiles, indexed as grid[x][y]
+        @param score: the score
+        @param path: the file to write to
+        """
+        self.render(grid, score).write_to_png(path)
+
+    def write_raw(self, grid, score, f):
+        """Draws a position and writes it to a file as raw 8 bit RGB pixels, row by row.
+
+        The frames of a game written one after another to a pipe can be read by a video encoder, such as ffmpeg with
+        -f rawvideo -pix_fmt rgb24 and the size of the frames.
+
+        @param grid: the values of the tiles, indexed as grid[x][y]
+        @param score: the score
+        @param f: the file or pipe to write to
+        """
+        surface = self.render(grid, score)
+        # Cairo holds each pixel of an RGB24 surface as a native 32 bit integer, which is BGRX in memory on a little
+        # endian machine
+        pixels = numpy.frombuffer(surface.get_data(), dtype=numpy.uint32)
+        pixels = pixels.reshape(self.painter.height, surface.get_stride() // 4)[:, :self.painter.width]
+        rgb = numpy.empty((self.painter.height, self.painter.width, 3), dtype=numpy.uint8)
+        rgb[:, :, 0] = pixels >> 16
+        rgb[:, :, 1] = pixels >> 8
+        rgb[:, :, 2] = pixels
+        f.write(rgb.tobytes())
+
+
+def replay_positions(replay, g):
+    """Generates every position of a recorded game, from before the first move to the end.
+
+    @param replay: the trajectory.Replay holding the game
+    @param g: the index of the game
+    @return: a generator of the grid, indexed as grid[x][y], and the score of each position
+    """
+    for k in range(replay.get_move_count(g) + 1):
+        board, score, playing = replay.get_position(g, k)
+        yield bitboard.unpack_board(board), score
+
+
+def live_positions(cont, g=None):
+    """Plays a game with a controller, generating each position as it is reached.
+
+    The moves are chosen as in controller.run_game.
+
+    @param cont: the controller to play with
+    @param g: the game to play, a new game.Game with the controller's grid size if none is given
+    @return: a generator of the grid, indexed as grid[x][y], and the score of each position
+    """
+    if g is None:
+        g = game.Game(grid_size=getattr(cont, "grid_size", 4))
+    yield g.grid, g.get_score()
+    while g.get_playing():
+        decision = numpy.array(cont.get_decision(g), dtype=float)
+        for i in range(4):
+            direction = decision.argmax()
+            if g.test_move(game.moves[direction]):
+                g.make_move(game.moves[direction])
+                break
+            decision[direction] = -numpy.inf
+        yield g.grid, g.get_score()
+
+
+def write_png_frames(positions, pattern, renderer=None, game_index=None):
+    """Writes each position of a game to a numbered PNG file.
+
+    @param positions: an iterable of the grid and score of each position, such as from replay_positions
+    @param pattern: the name of the files, with a %i field for the number of the frame, after a %i field for the
+    index of the game if one is given
+    @param renderer: the FrameRenderer to draw with, or None for a new 4x4 one
+    @param game_index: the index of the game for the file names, or None
+    @return: the number of frames written
+    """
+    if renderer is None:
+        renderer = FrameRenderer()
+    count = 0
+    for grid, score in positions:
+        if game_index is None:
+            path = pattern % count
+        else:
+            path = pattern % (game_index, count)
+        renderer.write_png(grid, score, path)
+        count += 1
+    return count
+
+
+def write_raw_frames(positions, f, renderer=None):
+    """Writes each position of a game to a file or pipe as raw RGB pixels, one frame after another.
+
+    @param positions: an iterable of the grid and score of each position, such as from replay_positions
+    @param f: the file or pipe to write to
+    @param renderer: the FrameRenderer to draw with, or None for a new 4x4 one
+    @return: the number of frames written
+    """
+    if renderer is None:
+        renderer = FrameRenderer()
+    count = 0
+    for grid, score in positions:
+        renderer.write_raw(grid, score, f)
+        count += 1
+    return count
+
+
+def render_replay(path, pattern, games=None, raw=False, proc=1):
+    """Renders recorded games, splitting the games between worker processes.
+
+    @param path: the file of records written by a trajectory.TrajectoryWriter
+    @param pattern: for PNG frames, the name of the files with %i fields for the index of the game and the number of
+    the frame. For raw frames, the name of the file for each game's frames with a %i field for the index of the game.
+    @param games: a list of the indices of the games to render, or None for all of them
+    @param raw: whether to write raw RGB frames rather than PNG files
+    @param proc: the number of worker processes
+    @return: the number of frames written for each game
+    """
+    if games is None:
+        games = list(range(trajectory.Replay(path).get_game_count()))
+    tasks = [(g, pattern, raw) for g in games]
+    # Each worker keeps its replay and its renderer, with the tiles it has drawn, for every game it is given
+    pool = Pool(proc, initializer=_init_worker, initargs=(path,))
+    try:
+        return pool.map(_render_game, tasks, max(1, len(tasks) // (4 * proc)))
+    finally:
+        pool.close()
+        pool.join()
+
+
+def _init_worker(path):
+    """Sets up a worker process for render_replay.
+
+    @param path: the file of records
+    """
+    _worker["replay"] = trajectory.Replay(path)
+    _worker["renderer"] = FrameRenderer()
+
+
+def _render_game(task):
+    """Renders one recorded game in a worker process.
+
+    @param task: the index of the game, the pattern of the file names and whether to write raw frames
+    @return: the number of frames written
+    """
+    g, pattern, raw = task
+    positions = replay_positions(_worker["replay"], g)
+    if raw:
+        with open(pattern % g, "wb") as f:
+            return write_raw_frames(positions, f, _worker["renderer"])
+    return write_png_frames(positions, pattern, _worker["renderer"], g)
+
+_worker = {}
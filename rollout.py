@@ -0,0 +1,85 @@
+import numpy
+
+import batch_game
+import bitboard
+
+
+class RolloutController(object):
+    """A controller that chooses moves by playing many quick games from each possible move.
+
+    For each legal move, a number of playouts are run from the position after it, choosing each move of the playout
+    at random or greedily by the score it gains. The move with the highest mean final score is chosen. All of the
+    playouts for a decision are run together on one batch_game.BatchGame.
+
+    Use it in place of a Controller in controller.run_game.
+    """
+
+    def __init__(self, playouts=100, depth=None, policy="random", seed=None):
+        """Sets up the playouts.
+
+        @param playouts: the number of playouts to run from each move
+        @param depth: the most moves to make in each playout, or None to play each one to the end of the game
+        @param policy: random to choose playout moves at random, or greedy to choose the move gaining the highest
+        score, breaking ties at random
+        @param seed: seed for the random number generator used for spawning tiles and choosing moves
+        """
+        if policy not in ("random", "greedy"):
+            raise ValueError("%s is not a recognised playout policy" % policy)
+        self.playouts = playouts
+        self.depth = depth
+        self.policy = policy
+        self.rng = numpy.random.RandomState(seed)
+
+    def get_decision(self, g):
+        """Returns the mean final score of the playouts from each move in a game.
+
+        @param g: the game being played, which must be 4x4
+        @return: an array with a value for each move in game.moves, -inf for an illegal move
+        """
+        board = getattr(g, "board", None)
+        if board is None:
+            if len(g.grid) != 4:
+                raise ValueError("%s only plays 4x4 games" % type(self).__name__)
+            board = bitboard.pack_grid(g.grid)
+        root = numpy.array([board], dtype=numpy.uint64)
+
+        # Start a block of playouts from the position after each legal move
+        starts = []
+        scores = []
+        legal = []
+        for direction in range(4):
+            new_board, score = batch_game.move(root, direction)
+            if new_board[0] != root[0]:
+                legal.append(direction)
+                starts.append(new_board[0])
+                scores.append(score[0])
+
+        decision = numpy.full(4, -numpy.inf)
+        if not legal:
+            return decision
+
+        games = batch_game.BatchGame(len(legal) * self.playouts, self.rng.randint(2 ** 31))
+        games.start_from(numpy.repeat(numpy.array(starts, dtype=numpy.uint64), self.playouts),
+                         numpy.repeat(numpy.array(scores, dtype=numpy.int64), self.playouts))
+
+        moves = 0
+        while games.get_playing().any() and (self.depth is None or moves < self.depth):
+            games.make_move(self._choose_moves(games))
+            moves += 1
+
+        decision[legal] = games.get_scores().reshape(len(legal), self.playouts).mean(axis=1)
+        return decision
+
+    def _choose_moves(self, games):
+        """Returns the next move of each playout according to the policy.
+
+        @param games: the playouts
+        @return: an array holding the index in game.moves of the move for each playout
+        """
+        # Random values break ties, and rank the legal moves at random for the random policy
+        preference = self.rng.random_sample((games.n, 4))
+        if self.policy == "greedy":
+            for direction in range(4):
+                preference[:, direction] += batch_game.move(games.boards, direction)[1]
+        preference[~games.test_moves()] = -1
+        return preference.argmax(axis=1)
@@ -0,0 +1,179 @@
+from getpass import getuser
+import hashlib
+import hmac
+import os
+import random
+import struct
+
+import game
+import utils
+
+
+class SaveFormatError(Exception):
+    """Exception for a save file that cannot be read."""
+
+
+def write_save(path, g, history=(), key=None):
+    """Writes a game to a save file.
+
+    The file starts with a fixed header of the magic bytes, the format version, flags, the grid size, the score and
+    the lengths of the sections that follow. Then come the tiles, the state of the game's random number generator
+    and the history of moves. The tiles are held as 4 bit exponents in 64 bit words, laid out as in
+    bitboard.BitboardGame so that a 4x4 grid is a single word, or as one byte each if a tile is too large for 4 bits.
+    If a key is given, an HMAC of everything before it is added at the end.
+
+    The file is replaced atomically with utils.atomic_write.
+
+    @param path: the file to write to
+    @param g: the game, a game.Game or any object with the same grid, grid_size, score and rng attributes
+    @param history: the index in game.moves of each move made so far
+    @param key: the key to sign the save with, such as from get_key, or None to leave it unsigned
+    """
+    size = g.grid_size
+    exponents = [g.grid[x][y].bit_length() - 1 if g.grid[x][y] else 0 for y in range(size) for x in range(size)]
+    flags = 0
+    if max(exponents) > 15:
+        flags |= _wide_tiles
+        tiles = struct.pack("<%iB" % len(exponents), *exponents)
+    else:
+        words = [0] * ((len(exponents) + 15) // 16)
+        for i, e in enumerate(exponents):
+            words[i // 16] |= e << (4 * (i % 16))
+        tiles = struct.pack("<%iQ" % len(words), *words)
+    rng_state = _pack_rng_state(g.rng)
+    moves = struct.pack("<%iB" % len(history), *history)
+    if key is not None:
+        flags |= _signed
+
+    data = (_header.pack(magic, version, flags, size, 0, g.score, len(history), len(rng_state)) + tiles + rng_state +
+            moves)
+    if key is not None:
+        data += hmac.new(key, data, hashlib.sha256).digest()
+
+    utils.atomic_write(path, lambda f: f.write(data))
+
+
+def read_save(path, key=None):
+    """Reads a save file written by write_save.
+
+    @param path: the file to read
+    @param key: the key the save must be signed with, or None to read it without checking for a signature
+    @return: a dictionary of the grid_size, the grid indexed as grid[x][y], the score, the rng_state for the
+    setstate method of a random.Random or None if none was saved, and the history of moves
+    """
+    with open(path, "rb") as f:
+        data = f.read()
+    if len(data) < _header.size:
+        raise SaveFormatError("Save file is too short")
+    file_magic, file_version, flags, size, reserved, score, moves, rng_length = _header.unpack_from(data)
+    if file_magic != magic:
+        raise SaveFormatError("Not a save file")
+    if file_version != version:
+        raise SaveFormatError("Save file version %i is not supported" % file_version)
+    if not game.min_grid_size <= size <= game.max_grid_size:
+        raise SaveFormatError("Save file grid size %i is not supported" % size)
+
+    if flags & _wide_tiles:
+        tiles_length = size * size
+    else:
+        tiles_length = 8 * ((size * size + 15) // 16)
+    end = _header.size + tiles_length + rng_length + moves
+    if flags & _signed:
+        if len(data) != end + _mac_size:
+            raise SaveFormatError("Save file is the wrong length")
+        if key is not None and not hmac.compare_digest(data[end:], hmac.new(key, data[:end], hashlib.sha256).digest()):
+            raise SaveFormatError("Save file signature does not match")
+    elif key is not None:
+        raise SaveFormatError("Save file is not signed")
+    elif len(data) != end:
+        raise SaveFormatError("Save file is the wrong length")
+
+    offset = _header.size
+    if flags & _wide_tiles:
+        exponents = struct.unpack_from("<%iB" % tiles_length, data, offset)
+    else:
+        words = struct.unpack_from("<%iQ" % (tiles_length // 8), data, offset)
+        exponents = [(words[i // 16] >> (4 * (i % 16))) & 0xF for i in range(size * size)]
+    grid = [[0] * size for i in range(size)]
+    for y in range(size):
+        for x in range(size):
+            if exponents[size * y + x]:
+                grid[x][y] = 1 << exponents[size * y + x]
+    offset += tiles_length
+
+    rng_state = _unpack_rng_state(data[offset:offset + rng_length])
+    offset += rng_length
+    history = list(struct.unpack_from("<%iB" % moves, data, offset))
+    if any(m not in game.moves for m in history):
+        raise SaveFormatError("Save file history holds an unknown move")
+
+    return {"grid_size": size, "grid": grid, "score": score, "rng_state": rng_state, "history": history}
+
+
+def get_slot_path(slot, directory=""):
+    """Returns the file for a save slot.
+
+    @param slot: the number of the slot
+    @param directory: the directory holding the save files
+    """
+    return os.path.join(directory, slot_file % slot)
+
+
+def get_key(password=None):
+    """Returns the key for signing saves, derived from a password the first time it is needed.
+
+    The derivation is deliberately slow, so its result is kept for the rest of the process.
+
+    @param password: the password, by default the name of the user
+    """
+    if password is None:
+        password = getuser()
+    key = _keys.get(password)
+    if key is None:
+        key = hashlib.pbkdf2_hmac("sha256", password.encode("utf-8"), key_salt, key_iterations)
+        _keys[password] = key
+    return key
+
+
+def _pack_rng_state(rng):
+    """Returns the state of a Mersenne Twister generator as bytes, or no bytes if it has no state to save.
+
+    @param rng: the generator, such as a random.Random or the random module
+    """
+    state = getattr(rng, "getstate", lambda: None)()
+    if state is None or state[0] != 3 or len(state[1]) != 625:
+        return b""
+    gauss_next = state[2]
+    return _rng_state.pack(*(list(state[1]) + [gauss_next is not None, gauss_next or 0.0]))
+
+
+def _unpack_rng_state(data):
+    """Returns the state packed by _pack_rng_state, as for random.Random.setstate, or None if there is none."""
+    if not data:
+        return None
+    if len(data) != _rng_state.size:
+        raise SaveFormatError("Random number generator state is the wrong length")
+    values = _rng_state.unpack(data)
+    gauss_next = values[626] if values[625] else None
+    state = 3, tuple(values[:625]), gauss_next
+    # Check that a generator will accept the state, so that a corrupt one is found here rather than when it is used
+    try:
+        random.Random().setstate(state)
+    except (ValueError, TypeError) as e:
+        raise SaveFormatError("Random number generator state is not valid (%s)" % e)
+    return state
+
+magic = b"2048"
+version = 1
+slot_file = "save_game_%i.sav"
+key_salt = b"2048 save game"
+key_iterations = 100000
+
+# The header: magic bytes, version, flags, grid size, a reserved byte, score, number of moves and length of the random
+# number generator state
+_header = struct.Struct("<4sBBBBQII")
+_rng_state = struct.Struct("<625I?d")
+_mac_size = 32
+_signed = 1
+_wide_tiles = 2
+_keys = {}
@@ -0,0 +1,96 @@
+from gi.repository import GLib
+from gi.repository import Gtk
+import threading
+import time
+
+import game
+import game_display as gd
+import render
+
+
+class Spectator(object):
+    """Shows a controller playing games in a GameDisplay, with the games played in a background thread.
+
+    The thread plays as fast as the controller allows, unless told to wait between moves, and only keeps the latest
+    position for the display. The display is updated from the Gtk main loop at a fixed frame rate with whatever
+    position is latest, so the game never waits for the screen and moves made between frames are skipped.
+    """
+
+    def __init__(self, cont, grid_size=4, fps=30, games=1, move_delay=0):
+        """Opens the display.
+
+        @param cont: the controller to watch, which may be any object with a get_decision method like Controller's
+        @param grid_size: the number of tiles along each side of the grid
+        @param fps: the most times to update the display each second
+        @param games: the number of games to play one after another, or None to keep playing until stopped
+        @param move_delay: the time to wait after each move in seconds, to slow the games down enough to follow
+        """
+        self.cont = cont
+        self.grid_size = grid_size
+        self.fps = fps
+        self.games = games
+        self.move_delay = move_delay
+        self.display = gd.GameDisplay(grid_size)
+        self.display.win.connect("destroy", self._destroyed)
+
+        # The latest position, replaced as a whole by the playing thread so the display never sees half a move
+        self.latest = None
+        self.shown = None
+        self.played = 0
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._play)
+        self.thread.daemon = True
+        self.timeout = None
+
+    def start(self):
+        """Starts playing and updating the display. The Gtk main loop must be running for the display to update."""
+        self.timeout = GLib.timeout_add(max(1, 1000 // self.fps), self._update)
+        self.thread.start()
+
+    def stop(self):
+        """Stops playing after the current move and stops updating the display."""
+        self.stopped.set()
+        if self.timeout is not None:
+            GLib.source_remove(self.timeout)
+            self.timeout = None
+
+    def _play(self):
+        """Plays the games, keeping the latest position of each."""
+        while not self.stopped.is_set() and (self.games is None or self.played < self.games):
+            g = game.Game(grid_size=self.grid_size)
+            for grid, score in render.live_positions(self.cont, g):
+                self.latest = ([list(column) for column in grid], score, g.get_playing(), self.played)
+                if self.stopped.is_set():
+                    return
+                if self.move_delay:
+                    time.sleep(self.move_delay)
+            self.played += 1
+
+    def _update(self):
+        """Shows the latest position, if it has changed since the last update. Runs in the Gtk main loop."""
+        latest = self.latest
+        if latest is not None and latest is not self.shown:
+            grid, score, playing, played = latest
+            self.display.grid = grid
+            self.display.score = score
+            self.display.playing = playing
+            self.display.win.set_title("2048 - game %i" % (played + 1))
+            self.display.win.queue_draw()
+            self.shown = latest
+        return self.timeout is not None
+
+    def _destroyed(self, window):
+        """Stops when the window is closed."""
+        del window
+        self.stop()
+
+
+def watch(cont, grid_size=4, fps=30, games=None, move_delay=0):
+    """Opens a window showing a controller play, and runs the Gtk main loop until the window is closed.
+
+    The arguments are as for Spectator.
+    """
+    spectator = Spectator(cont, grid_size, fps, games, move_delay)
+    spectator.display.win.connect("destroy", Gtk.main_quit)
+    spectator.start()
+    Gtk.main()
@@ -0,0 +1,129 @@
+import os
+import numpy
+
+import utils
+
+
+def build_tables():
+    """Builds the tables giving the result of moving every possible row of a 4x4 grid.
+
+    A row is a 16 bit word holding four 4 bit exponents, with a value of 0 for a free space and n for a tile of value
+    2**n. The first tile of the row is in the lowest nibble, and a move left is a move towards it. Exponents are
+    capped at 15 so that the result of a move still fits in a nibble.
+
+    @return: a dictionary of arrays indexed by row: the rows after moving left and right, the scores gained by each
+    move, and whether each move changes the row
+    """
+    left = numpy.zeros(65536, dtype=numpy.uint16)
+    right = numpy.zeros(65536, dtype=numpy.uint16)
+    score_left = numpy.zeros(65536, dtype=numpy.uint32)
+    score_right = numpy.zeros(65536, dtype=numpy.uint32)
+    for row in range(65536):
+        cells = [(row >> (4 * i)) & 0xF for i in range(4)]
+
+        moved, score = _move_row_left(cells)
+        left[row] = moved[0] | (moved[1] << 4) | (moved[2] << 8) | (moved[3] << 12)
+        score_left[row] = score
+
+        moved, score = _move_row_left(cells[::-1])
+        right[row] = moved[3] | (moved[2] << 4) | (moved[1] << 8) | (moved[0] << 12)
+        score_right[row] = score
+
+    rows = numpy.arange(65536, dtype=numpy.uint16)
+    return {"left": left,
+            "right": right,
+            "score_left": score_left,
+            "score_right": score_right,
+            "changed_left": left != rows,
+            "changed_right": right != rows}
+
+
+def _move_row_left(row):
+    """Applies the move taking algorithm to a row of exponents, returning the new row and the score.
+
+    @param row: a list of four exponents, the first being the one moved towards
+    """
+    tiles = [e for e in row if e != 0]
+    result = []
+    score = 0
+    i = 0
+    while i < len(tiles):
+        if i + 1 < len(tiles) and tiles[i] == tiles[i + 1]:
+            merged = tiles[i] + 1
+            score += 1 << merged
+            result.append(min(merged, 15))
+            i += 2
+        else:
+            result.append(tiles[i])
+            i += 1
+    result += [0] * (4 - len(result))
+    return result, score
+
+
+def spread(rows):
+    """Spreads the nibbles of 16 bit rows out by 16 bits, turning each row into a column of a 64 bit board.
+
+    @param rows: an array of rows
+    @return: an array of boards holding each row as the column at x = 0
+    """
+    rows = rows.astype(numpy.uint64)
+    column = rows & 0xF
+    for i in range(1, 4):
+        column |= ((rows >> (4 * i)) & 0xF) << (16 * i)
+    return column
+
+
+def save_tables(tables, path):
+    """Writes the tables to a file.
+
+    The file is replaced atomically with utils.atomic_write, as other processes may be reading it.
+
+    @param tables: the dictionary of tables from build_tables
+    @param path: the file to write to
+    """
+    utils.atomic_write(path, lambda f: numpy.savez(f, version=numpy.array([version]), **tables))
+
+
+def read_tables(path):
+    """Reads the tables from a file written by save_tables.
+
+    @param path: the file to read from
+    @return: the dictionary of tables, or None if the file is missing or was written by another version
+    """
+    try:
+        with numpy.load(path) as f:
+            if f["version"][0] != version:
+                return None
+            return dict((name, f[name]) for name in table_names)
+    except (IOError, OSError, KeyError, ValueError):
+        return None
+
+
+def load_tables(path=None):
+    """Returns the row move tables.
+
+    The tables are read from the cache file, and only built if the file is missing or out of date, in which case they
+    are written to it for next time. They are then kept for the rest of the process, so worker processes forked after
+    the first call share them.
+
+    @param path: the cache file, defaulting to cache_file
+    @return: the dictionary of tables described in build_tables
+    """
+    global _tables
+    if _tables is None:
+        if path is None:
+            path = cache_file
+        tables = read_tables(path)
+        if tables is None:
+            tables = build_tables()
+            try:
+                save_tables(tables, path)
+            except (IOError, OSError):
+                pass
+        _tables = tables
+    return _tables
+
+version = 1
+table_names = ["left", "right", "score_left", "score_right", "changed_left", "changed_right"]
+cache_file = os.path.join(os.path.dirname(os.path.abspath(__file__)), "row_tables.npz")
+_tables = None
@@ -0,0 +1,36 @@
+#!/usr/bin/env python
+import copy
+import pickle
+import unittest
+import numpy
+
+import controller
+
+
+class NumpyNetworkCopyTest(unittest.TestCase):
+    """Checks that a copied NumpyNetwork still evaluates with its own parameters."""
+
+    def setUp(self):
+        numpy.random.seed(0)
+        self.cont = controller.NumpyController(4, [8, 8])
+        self.inp = numpy.arange(16, dtype=float)
+
+    def test_deepcopy_then_mutate(self):
+        copied = copy.deepcopy(self.cont)
+        before = copied.net.activate(self.inp)
+        copied.mutate(1.0)
+        self.assertFalse(numpy.allclose(before, copied.net.activate(self.inp)))
+        # The original is left as it was
+        numpy.testing.assert_array_equal(before, self.cont.net.activate(self.inp))
+
+    def test_pickle_keeps_weights_as_views(self):
+        net = pickle.loads(pickle.dumps(self.cont.net, 2))
+        for w in net.weights:
+            self.assertTrue(numpy.shares_memory(net.params, w))
+        numpy.testing.assert_array_equal(net.activate(self.inp), self.cont.net.activate(self.inp))
+        net.params[:] += 1
+        self.assertFalse(numpy.allclose(net.activate(self.inp), self.cont.net.activate(self.inp)))
+
+
+if __name__ == "__main__":
+    unittest.main()
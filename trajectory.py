@@ -0,0 +1,262 @@
+import os
+import random
+import struct
+import numpy
+
+import bitboard
+import game
+import utils
+
+
+class TrajectoryWriter(object):
+    """Streams the moves of games to an append-only file of fixed size binary records.
+
+    Each move is stored as a 13 byte record: the board before the move as a 64 bit integer of 4 bit exponents laid
+    out as in bitboard.BitboardGame, one byte of information about the move and the score after it as a 32 bit
+    integer, all little endian. The information byte holds the index of the move in game.moves in bits 0 and 1, the
+    index 4*y + x of the space the following tile spawned in in bits 2 to 5, whether that tile was a 4 rather than a 2
+    in bit 6, and whether the game ended with the move in bit 7. Only moves that change the board are recorded.
+
+    Records are collected in memory and written in blocks. Attach a writer to a game with controller.run_game, or by
+    setting the recorder attribute of a game.Game or bitboard.BitboardGame.
+    """
+
+    def __init__(self, path, buffer_size=4096):
+        """Opens the file for appending.
+
+        @param path: the file to write to
+        @param buffer_size: the number of records to collect before writing them out
+        """
+        self.path = path
+        self.buffer_size = buffer_size
+        self.buffer = []
+        self.file = open(path, "ab")
+
+    def record(self, board, move, position, exponent, score, end):
+        """Adds the record of a move.
+
+        @param board: the board before the move, as a 64 bit integer of 4 bit exponents
+        @param move: the index in game.moves of the direction of the move
+        @param position: the index 4*y + x of the space the new tile spawned in
+        @param exponent: the exponent of the new tile, 1 for a 2 or 2 for a 4
+        @param score: the score after the move
+        @param end: whether the game is over after the move
+        """
+        info = move | (position << 2) | ((exponent - 1) << 6) | (bool(end) << 7)
+        self.buffer.append(_record.pack(board, info, score))
+        if len(self.buffer) >= self.buffer_size:
+            self.flush()
+
+    def record_grid(self, grid, move, position, exponent, score, end):
+        """Adds the record of a move from a 4x4 grid of tile values, indexed as grid[x][y], as held by game.Game.
+
+        The other arguments are as for record.
+        """
+        if len(grid) != 4:
+            raise ValueError("Only moves on 4x4 grids can be recorded")
+        self.record(bitboard.pack_grid(grid), move, position, exponent, score, end)
+
+    def flush(self):
+        """Writes out the collected records."""
+        if self.buffer:
+            self.file.write(b"".join(self.buffer))
+            self.buffer = []
+        self.file.flush()
+
+    def close(self):
+        """Writes out the collected records and closes the file."""
+        if not self.file.closed:
+            self.flush()
+            self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class Replay(object):
+    """Reads the games recorded by a TrajectoryWriter, with any move of any game reached directly.
+
+    The records are mapped into memory rather than read, so files larger than memory can be replayed. The position of
+    the first record of each game is kept in an index file next to the records, which is built the first time the
+    file is replayed and rebuilt whenever more records have been appended since. A game still being recorded, whose
+    last record does not end the game, is included as the last game.
+    """
+
+    def __init__(self, path, index_path=None):
+        """Opens the records and their index.
+
+        @param path: the file of records
+        @param index_path: the index file, defaulting to the file of records with .idx appended
+        """
+        if index_path is None:
+            index_path = path + ".idx"
+        self.path = path
+        self.index_path = index_path
+        self.records = read_records(path)
+        self.starts = read_index(index_path)
+        if self.starts is None or self.starts[-1] != len(self.records):
+            self.starts = build_index(self.records)
+            write_index(index_path, self.starts)
+
+    def get_game_count(self):
+        """Returns the number of recorded games."""
+        return len(self.starts) - 1
+
+    def get_move_count(self, g):
+        """Returns the number of recorded moves in a game.
+
+        @param g: the index of the game
+        """
+        return int(self.starts[g + 1] - self.starts[g])
+
+    def get_record(self, g, k):
+        """Returns the record of a move.
+
+        @param g: the index of the game
+        @param k: the index of the move within the game
+        @return: the board before the move, the index of the move in game.moves, the index 4*y + x of the space the
+        following tile spawned in, the value of that tile, the score after the move and whether the game ended with it
+        """
+        if not 0 <= k < self.get_move_count(g):
+            raise IndexError("Game %i has no move %i" % (g, k))
+        record = self.records[self.starts[g] + k]
+        move, position, value, end = unpack_info(record["info"])
+        return int(record["board"]), int(move), int(position), int(value), int(record["score"]), bool(end)
+
+    def get_position(self, g, k):
+        """Returns the position before a move.
+
+        @param g: the index of the game
+        @param k: the index of the move within the game, or the number of moves in the game for the final position
+        @return: the board as a 64 bit integer of 4 bit exponents, the score and whether the game is still playing
+        """
+        count = self.get_move_count(g)
+        if k == count and count > 0:
+            board, move, position, value, score, end = self.get_record(g, k - 1)
+            board = bitboard.move(board, game.moves[move])[0] | ((value // 2) << (4 * position))
+            return board, score, not end
+        board = self.get_record(g, k)[0]
+        if k == 0:
+            return board, 0, True
+        return board, self.get_record(g, k - 1)[4], True
+
+    def get_game(self, g, k):
+        """Rebuilds the game as it was before a move.
+
+        @param g: the index of the game
+        @param k: the index of the move within the game, or the number of moves in the game for the final position
+        @return: a game.Game in the same position, with its own random number generator
+        """
+        replayed = game.Game(random.Random())
+        set_position(replayed, *self.get_position(g, k))
+        return replayed
+
+    def iter_batches(self, batch_size=65536):
+        """Generates the recorded moves of every game in turn, in blocks read from the file as they are needed.
+
+        @param batch_size: the number of moves in each block
+        @return: a generator of tuples of arrays, holding for each move in the block the index of its game, the board
+        before it, the index of the move in game.moves and the score after it
+        """
+        for first in range(0, len(self.records), batch_size):
+            block = numpy.array(self.records[first:first + batch_size])
+            games = numpy.searchsorted(self.starts, numpy.arange(first, first + len(block)), side="right") - 1
+            yield games, block["board"], block["info"] & 0x3, block["score"]
+
+    def show(self, g, k, display=None):
+        """Shows the position before a move in a window.
+
+        @param g: the index of the game
+        @param k: the index of the move within the game, or the number of moves in the game for the final position
+        @param display: the game_display.GameDisplay to show the position in, or None to open a new one
+        @return: the display
+        """
+        if display is None:
+            import game_display
+            display = game_display.GameDisplay()
+        set_position(display, *self.get_position(g, k))
+        display.win.queue_draw()
+        return display
+
+
+def set_position(g, board, score, playing):
+    """Puts a game into a position.
+
+    @param g: the game, a game.Game or any object with the same grid, score and playing attributes
+    @param board: the board as a 64 bit integer of 4 bit exponents
+    @param score: the score
+    @param playing: whether the game is still playing
+    """
+    g.grid = bitboard.unpack_board(board)
+    g.score = score
+    g.playing = playing
+
+
+def build_index(records):
+    """Finds where each game starts in an array of records.
+
+    @param records: the records from read_records
+    @return: an array of the index of the first record of each game, followed by the number of records
+    """
+    if len(records) == 0:
+        return numpy.zeros(1, dtype=numpy.int64)
+    ends = numpy.flatnonzero(numpy.asarray(records["info"]) & 0x80) + 1
+    if len(ends) == 0 or ends[-1] != len(records):
+        ends = numpy.append(ends, len(records))
+    return numpy.concatenate([[0], ends]).astype(numpy.int64)
+
+
+def write_index(path, starts):
+    """Writes an index from build_index to a file, replacing it atomically.
+
+    @param path: the file to write to
+    @param starts: the index
+    """
+    utils.atomic_write(path, lambda f: numpy.save(f, starts))
+
+
+def read_index(path):
+    """Maps an index written by write_index into memory.
+
+    @param path: the file to read
+    @return: the index, or None if the file is missing or unreadable
+    """
+    try:
+        return numpy.load(path, mmap_mode="r")
+    except (IOError, OSError, ValueError):
+        return None
+
+
+def read_records(path):
+    """Maps a file written by a TrajectoryWriter into memory as an array of records.
+
+    Any partial record left at the end of the file by an interrupted write is ignored.
+
+    @param path: the file to read
+    @return: a read only structured array of records with fields board, info and score
+    """
+    count = os.path.getsize(path) // record_dtype.itemsize
+    if count == 0:
+        return numpy.zeros(0, dtype=record_dtype)
+    return numpy.memmap(path, dtype=record_dtype, mode="r", shape=(count,))
+
+
+def unpack_info(info):
+    """Splits the information bytes of records into their fields.
+
+    @param info: an array of information bytes, such as the info field of the records from read_records
+    @return: arrays of the index of each move in game.moves, the index 4*y + x of the space each new tile spawned in,
+    the value of each new tile and whether the game ended with each move
+    """
+    info = numpy.asarray(info, dtype=numpy.uint8)
+    moves = info & 0x3
+    positions = (info >> 2) & 0xF
+    values = numpy.where(info & 0x40, 4, 2)
+    ends = (info & 0x80) != 0
+    return moves, positions, values, ends
+
+_record = struct.Struct("<QBI")
+record_dtype = numpy.dtype([("board", "<u8"), ("info", "u1"), ("score", "<u4")])
@@ -1,14 +1,6 @@
-import hashlib
 from math import log
-from getpass import getuser
-
-
-def get_password():
-    """Returns the password for saving and loading"""
-    m = hashlib.md5()
-    m.update(getuser())
-    password = m.digest()
-    return password
+import os
+import tempfile
 
 
 def is_power(num, base):
@@ -29,6 +21,29 @@ def is_power(num, base):
     return base ** power == num
 
 
+def atomic_write(path, write):
+    """Writes a file under a temporary name and then renames it into place, so that a crash or another process never
+    sees it half written.
+
+    @param path: the file to write
+    @param write: a function that writes the contents to the binary file object it is given
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, temp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            write(f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.rename(temp_path, path)
+    except Exception:
+        try:
+            os.remove(temp_path)
+        except OSError:
+            pass
+        raise
+
+
 class GameOverException(Exception):
     """Exception for when moves are attempted on a finished game."""
 